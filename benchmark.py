@@ -0,0 +1,117 @@
+import argparse
+import contextlib
+import glob
+import io
+import os
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+
+import pandas as pd
+
+from script import result
+from script.backtest import BacktestCanslimTrade, strategies
+from script.connect import JQuants
+from script.portfolio import BacktestPortfolio
+from script.synthetic import SyntheticClient, default_end, make_panel
+
+
+benchmark_dir = "./benchmark_result"
+
+
+def measure(func, repeat=1):
+    # 実行時間(最良値)とピークメモリを計測 (tracemallocは時間計測とは別の実行で使用)
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            out = func()
+        seconds.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return out, min(seconds), peak / 1024 ** 2
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return ""
+
+
+def run_portfolio(data, name):
+    bpt = BacktestPortfolio(None, None, 1000000, verbose=False)
+    bpt.run_portfolio(data, name, max_positions=10, score="UD_RATIO")
+    return bpt
+
+
+def run_benchmark(n_codes, n_years, seed=0, repeat=1):
+    records = []
+
+    def record(stage, func, rows):
+        out, seconds, peak = measure(func, repeat)
+        records.append({"stage" : stage, "rows" : rows, "seconds" : seconds, "peak_mb" : peak})
+        print(f'{stage:<40} {seconds:10.3f}s {peak:10.1f}MB')
+        return out
+
+    # バックテスト系
+    panel = make_panel(n_codes, n_years, seed)
+    panel["DATE"] = pd.to_datetime(panel["DATE"])
+    bct = BacktestCanslimTrade(None, None, 1000, verbose=False)
+    features = record("feature_engineering", lambda: bct.feature_engineering(panel.copy()), len(panel))
+
+    result.result_dir = os.path.join(benchmark_dir, "tmp")
+    for name in strategies:
+        record(name, lambda: BacktestCanslimTrade(None, None, 1000, verbose=False).run_strategy(name, features), len(features))
+    record("run_strategies", lambda: BacktestCanslimTrade(None, None, 1000, verbose=False).run_strategies(list(strategies), features), len(features))
+
+    record("run_portfolio", lambda: run_portfolio(features, "run_trend_1_and_match_num_over_5"), len(features))
+
+    # 取り込み系 (J-Quantsクライアントを合成データに差し替えて正規化処理のみ計測、期間は合成データの最終日から遡る)
+    jquants = JQuants(client=SyntheticClient(n_codes, n_years, seed), cache=False)
+    until = default_end.tz_localize("Asia/Tokyo") + pd.Timedelta(1, unit="D")
+    record("JQuants.get_stock", lambda: jquants.get_stock(since=until - pd.offsets.Day(int(n_years * 366)), until=until),
+           len(jquants.jqapi.prices))
+    record("JQuants.get_financial", lambda: jquants.get_financial(since=until - pd.offsets.MonthBegin(int(n_years * 12)), until=until),
+           len(jquants.jqapi.statements))
+
+    return pd.DataFrame(records).assign(
+        codes=n_codes, years=n_years, revision=git_revision(), timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+
+
+def compare_previous(df):
+    # 同じ規模で直近に保存した結果との比較
+    files = sorted(glob.glob(os.path.join(benchmark_dir, "benchmark_*.csv")))
+    for path in reversed(files):
+        prev = pd.read_csv(path)
+        prev = prev[(prev.codes == df.codes.iloc[0]) & (prev.years == df.years.iloc[0])]
+        if len(prev):
+            merged = df.merge(prev[["stage", "seconds", "peak_mb"]], on="stage", suffixes=("", "_prev"))
+            merged["time_ratio"] = merged.seconds / merged.seconds_prev
+            merged["memory_ratio"] = merged.peak_mb / merged.peak_mb_prev
+            print('----------------------- Compared with %s -----------------------' % os.path.basename(path))
+            print(merged[["stage", "seconds", "seconds_prev", "time_ratio", "peak_mb", "peak_mb_prev", "memory_ratio"]].to_string(index=False))
+            return merged
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--codes", type=int, default=500)
+    parser.add_argument("--years", type=float, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print("----------------------- Benchmark Start (%d codes x %.1f years) -----------------------" % (args.codes, args.years))
+    df = run_benchmark(args.codes, args.years, args.seed, args.repeat)
+    compare_previous(df)
+
+    os.makedirs(benchmark_dir, exist_ok=True)
+    df.to_csv(os.path.join(benchmark_dir, "benchmark_%s.csv" % datetime.now().strftime("%Y%m%d_%H%M%S")), index=False)
+    print("----------------------- Benchmark End -----------------------")
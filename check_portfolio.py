@@ -0,0 +1,41 @@
+import argparse
+import tempfile
+
+import pandas as pd
+
+from script import result
+from script.backtest import BacktestCanslimTrade
+from script.portfolio import BacktestPortfolio
+from script.synthetic import make_panel
+
+
+def check_late_listing(n_codes=100, n_years=3, seed=0, name="run_trend_1_and_match_num_over_5"):
+    ## 途中から上場する銘柄を含むパネルで、全銘柄の価格が揃う前からポートフォリオがエントリーできることを確認
+    panel = make_panel(n_codes, n_years, seed)
+    panel["DATE"] = pd.to_datetime(panel["DATE"])
+    features = BacktestCanslimTrade(None, None, 1000, verbose=False).feature_engineering(panel)
+
+    last_code = features["CODE"].cat.categories[-1]
+    listing_date = features["DATE"].quantile(0.9)
+    listed = features[(features["CODE"] != last_code) | (features["DATE"] >= listing_date)]
+
+    ## 結果ファイルは一時ディレクトリに書き出す
+    with tempfile.TemporaryDirectory() as directory:
+        result.result_dir = directory
+        bpt = BacktestPortfolio(None, None, 1000000, verbose=False)
+        bpt.run_portfolio(listed, name, max_positions=10, score="UD_RATIO")
+    held = bpt.daily_ret[bpt.daily_ret["positions"] > 0]
+    assert len(held) and pd.Timestamp(held["date"].iloc[0]) < listing_date, \
+        "run_portfolio: no entries before %s listed on %s" % (last_code, listing_date.date())
+    return pd.Timestamp(held["date"].iloc[0]), listing_date
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--codes", type=int, default=100)
+    parser.add_argument("--years", type=float, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    first_entry, listing_date = check_late_listing(args.codes, args.years, args.seed)
+    print("----------------------- OK: first entry %s, last code listed %s -----------------------" % (first_entry.date(), listing_date.date()))
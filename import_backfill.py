@@ -0,0 +1,128 @@
+import argparse
+import json
+import os
+import pandas as pd
+from script.connect import JQuants, report_task_states
+from script.warehouse import open_warehouse
+from script.watermark import Watermark
+
+## データセットごとの取り込み設定
+datasets = {
+    "stock" : {
+        "table" : "stock_update",
+        "task" : "stock_update_task",
+        "encoding" : "cp932",
+        "fetch" : lambda jqapi, since, until: jqapi.get_stock(since=since, until=until),
+        "watermark" : ("stock", ["Code", "Date"], "Date"),
+    },
+    "financial" : {
+        "table" : "financial_update",
+        "task" : "financial_update_task",
+        "encoding" : "utf8",
+        "fetch" : lambda jqapi, since, until: jqapi.get_financial(since=since, until=until),
+        "watermark" : ("financial", ["LocalCode", "DisclosedDate"], "DisclosedDate"),
+    },
+}
+
+checkpoint_dir = './metadata/backfill'
+
+
+def split_chunks(start, end, chunk_days):
+    starts = pd.date_range(start, end, freq="%dD" % chunk_days)
+    return [(s, min(s + pd.Timedelta(chunk_days - 1, unit="D"), pd.Timestamp(end))) for s in starts]
+
+
+def chunk_name(dataset, start, end):
+    return "backfill_%s_%s_%s" % (dataset, start.strftime("%Y%m%d"), end.strftime("%Y%m%d"))
+
+
+def load_checkpoint(dataset):
+    path = os.path.join(checkpoint_dir, "%s.json" % dataset)
+    if os.path.exists(path):
+        with open(path) as file:
+            return set(json.load(file)["done"])
+    return set()
+
+
+def save_checkpoint(dataset, done):
+    ## 中断しても完了済みのチャンクから再開できるよう、COPY完了ごとに原子的に書き込み
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    path = os.path.join(checkpoint_dir, "%s.json" % dataset)
+    with open(path + ".tmp", "w") as file:
+        json.dump({"done" : sorted(done)}, file)
+    os.replace(path + ".tmp", path)
+
+
+def load_batch(snowflake, dataset, stage_path, format, file_format):
+    ## ステージ済みのバッチ分のファイルをまとめてCOPYし、ステージから削除
+    conf = datasets[dataset]
+    if file_format == 'parquet':
+        snowflake.copy_table_parquet(conf["table"], stage_path, '.*backfill_%s_.*[.]parquet' % dataset)
+    else:
+        snowflake.copy_table(conf["table"], stage_path, format, '.*backfill_%s_.*[.]gz' % dataset)
+    snowflake.remove_stage(stage_path)
+
+
+def backfill(snowflake, jqapi, dataset, start, end, stage, format, chunk_days=30, batch_size=6, file_format='csv'):
+    conf = datasets[dataset]
+    done = load_checkpoint(dataset)
+    watermark = Watermark.load(*conf["watermark"])
+
+    ## 前回の中断でステージに残ったファイルは作り直す
+    stage_path = '%s/backfill_%s' % (stage, dataset)
+    snowflake.remove_stage(stage_path)
+
+    chunks = [c for c in split_chunks(start, end, chunk_days) if chunk_name(dataset, *c) not in done]
+    print("%s: %d chunks to load (%d already done)" % (dataset, len(chunks), len(done)))
+
+    batch, staged = [], 0
+    for i, (chunk_start, chunk_end) in enumerate(chunks):
+        ## 1チャンク分のみメモリに保持し、圧縮してステージに直接転送
+        name = chunk_name(dataset, chunk_start, chunk_end)
+        df = conf["fetch"](jqapi, chunk_start.tz_localize("Asia/Tokyo"), chunk_end.tz_localize("Asia/Tokyo"))
+        if len(df):
+            snowflake.stage_frame(df, stage_path, name, format=file_format, encoding=conf["encoding"])
+            watermark.commit(df)
+            staged += 1
+        batch.append(name)
+        del df
+
+        if len(batch) == batch_size or i == len(chunks) - 1:
+            if staged:
+                load_batch(snowflake, dataset, stage_path, format, file_format)
+            done.update(batch)
+            save_checkpoint(dataset, done)
+            watermark.save()
+            print("%s: loaded through %s" % (dataset, chunk_end.strftime("%Y-%m-%d")))
+            batch, staged = [], 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset", choices=list(datasets), nargs="+", default=list(datasets))
+    parser.add_argument("--start", required=True)
+    parser.add_argument("--end", default=pd.Timestamp.now(tz="Asia/Tokyo").strftime("%Y-%m-%d"))
+    parser.add_argument("--chunk-days", type=int, default=30)
+    parser.add_argument("--batch-size", type=int, default=6)
+    parser.add_argument("--file-format", choices=["csv", "parquet"], default="csv")
+    args = parser.parse_args()
+
+    print("----------------------- Backfill Start -----------------------")
+
+    ## Classの定義
+    snowflake = open_warehouse()
+    jqapi = JQuants(max_concurrency=4)
+
+    stage = '@data_csv'
+    format = 'file_csv'
+    snowflake.resume_tasks([datasets[dataset]["task"] for dataset in args.dataset])
+    since = {}
+    for dataset in args.dataset:
+        backfill(snowflake, jqapi, dataset, args.start, args.end, stage, format, args.chunk_days, args.batch_size, args.file_format)
+        since[datasets[dataset]["task"]] = snowflake.current_timestamp()
+        print("----------------------- Complete %s Backfill -----------------------" % dataset)
+
+    ## Taskの停止 (最後のCOPY以降の実行が完了したTaskから順に停止)
+    states = snowflake.wait_tasks(since)
+    report_task_states(states)
+    print("----------------------- Complete Suspend Task -----------------------")
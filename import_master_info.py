@@ -9,130 +9,90 @@ import time
 from snowflake.snowpark import Session
 from script.connect import Snowflake
 from script.connect import JQuants
+from script.warehouse import open_warehouse
+from script.snapshot import TableSnapshot
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+
+## 取得・差分計算は並列、ウェアハウスへの反映はこのロックで直列化
+warehouse_lock = threading.Lock()
+
+def master_import(snowflake, df, table, key, name, stage, format, ignore=()):
+    ## 前回取り込み分との差分を取り、変更が無ければスキップ、少数の変更は行単位で反映
+    pattern = '.*%s.*' % name
+    snapshot = TableSnapshot.load(table, key, ignore)
+    status, upserts, deletes = snapshot.diff(df)
+    if status == 'unchanged':
+        return status
+
+    ## ステージ転送・テーブル操作は1つのセッションを共有するため直列に実行
+    ## (他スレッドのDDLが暗黙にコミットし、apply_diffの削除とCOPYのトランザクションが分断されないように)
+    with warehouse_lock:
+        ## インポート用の圧縮CSVをメモリ上で作成してステージに転送
+        if len(upserts):
+            snowflake.stage_frame(upserts, stage, name)
+
+        if status == 'full':
+            ## スキーマ取得
+            schema = snowflake.convert_column_type(df)
+
+            ## テーブル再作成
+            snowflake.replace_table(table, schema)
+
+            ## データインポート
+            snowflake.copy_table(table, stage, format, pattern)
+        else:
+            ## 変更行の削除と再インポート
+            snowflake.apply_diff(table, key, pd.concat([upserts[key], deletes]), stage, format, pattern, copy=len(upserts) > 0)
+
+    snapshot.save(df)
+    return '%s (%d upserted, %d deleted)' % (status, len(upserts), 0 if deletes is None else len(deletes))
 
-def stock_code_import(snowflake, jqapi, stage, format):
-    ## Snowflake環境のインポート設定
-    tmp_path = './tmp_data/stock_code_update.csv'
-    table = 'stock_code'
-    pattern = '.*stock_code_update.csv.*'
 
-    ## 情報の取得
+def stock_code_import(snowflake, jqapi, stage, format):
+    ## 銘柄一覧 (取得日のDate列は比較対象外)
     stock_code = jqapi.get_stock_code()
-
-    ## インポート用のCSVファイル取得
-    stock_code.to_csv(tmp_path, index=False, encoding='utf8')
-
-    ## インポート用のCSVファイルをステージに転送
-    snowflake.put_stage(tmp_path, stage)
-
-    ## スキーマ取得
-    schema = snowflake.convert_column_type(stock_code)
-
-    ## テーブル再作成
-    snowflake.replace_table(table, schema)
-
-    ## データインポート
-    snowflake.copy_table(table, stage, format, pattern)
-    os.remove(tmp_path)
+    return master_import(snowflake, stock_code, 'stock_code', ['Code'], 'stock_code_update.csv', stage, format, ignore=['Date'])
 
 
 def sector_33_import(snowflake, jqapi, stage, format):
-    ## Snowflake環境のインポート設定
-    tmp_path = './tmp_data/sector_33_update.csv'
-    table = 'sector_33_code'
-    pattern = '.*sector_33_update.csv.*'
-
-    ## 情報の取得
     stock_sectors = jqapi.get_sector_33_code()
-
-    ## インポート用のCSVファイルをステージに転送
-    stock_sectors.to_csv(tmp_path, index=False, encoding='utf8')
-    snowflake.put_stage(tmp_path, stage)
-
-    ## スキーマ取得
-    schema = snowflake.convert_column_type(stock_sectors)
-
-    ## テーブル再作成
-    snowflake.replace_table(table, schema)
-
-    ## データインポート
-    snowflake.copy_table(table, stage, format, pattern)
-    os.remove(tmp_path)
+    return master_import(snowflake, stock_sectors, 'sector_33_code', [stock_sectors.columns[0]], 'sector_33_update.csv', stage, format)
 
 
 def sector_17_import(snowflake, jqapi, stage, format):
-    ## Snowflake環境のインポート設定
-    tmp_path = './tmp_data/sector_17_update.csv'
-    table = 'sector_17_code'
-    pattern = '.*sector_17_update.csv.*'
-
-    ## 情報の取得
     stock_sectors = jqapi.get_sector_17_code()
+    return master_import(snowflake, stock_sectors, 'sector_17_code', [stock_sectors.columns[0]], 'sector_17_update.csv', stage, format)
 
-    ## インポート用のCSVファイルをステージに転送
-    stock_sectors.to_csv(tmp_path, index=False, encoding='utf8')
-    snowflake.put_stage(tmp_path, stage)
-
-    ## スキーマ取得
-    schema = snowflake.convert_column_type(stock_sectors)
-
-    ## テーブル再作成
-    snowflake.replace_table(table, schema)
-
-    ## データインポート
-    snowflake.copy_table(table, stage, format, pattern)
-    os.remove(tmp_path)
 
 def market_import(snowflake, jqapi, stage, format):
-    ## Snowflake環境のインポート設定
-    tmp_path = './tmp_data/market_update.csv'
-    table = 'market_code'
-    pattern = '.*market_update.csv.*'
-
-    ## 情報の取得
     stock_market = jqapi.get_market_code()
-
-    ## インポート用のCSVファイルをステージに転送
-    stock_market.to_csv(tmp_path, index=False, encoding='utf8')
-    snowflake.put_stage(tmp_path, stage)
-
-    ## スキーマ取得
-    schema = snowflake.convert_column_type(stock_market)
-
-    ## テーブル再作成
-    snowflake.replace_table(table, schema)
-
-    ## データインポート
-    snowflake.copy_table(table, stage, format, pattern)
-    os.remove(tmp_path)
+    return master_import(snowflake, stock_market, 'market_code', [stock_market.columns[0]], 'market_update.csv', stage, format)
 
 
 if __name__ == "__main__":
     print("----------------------- Job Start -----------------------")
 
     ## Classの定義
-    snowflake = Snowflake()
+    snowflake = open_warehouse()
     jqapi = JQuants()
 
     ## 各データのインポート
     stage = '@data_csv'
     format = 'file_csv'
 
-    # 株価コードのインポート
-    stock_code_import(snowflake, jqapi, stage, format)
-    print("----------------------- Complete StockCode Import -----------------------")
-
-    # 33セクターコードのインポート
-    sector_33_import(snowflake, jqapi, stage, format)
-    print("----------------------- Complete SectorCode Import -----------------------")
-
-    # 17セクターコードのインポート
-    sector_17_import(snowflake, jqapi, stage, format)
-    print("----------------------- Complete SectorCode Import -----------------------")
-
-    # 市場コードのインポート
-    market_import(snowflake, jqapi, stage, format)
-    print("----------------------- Complete MarketCode Import -----------------------")
+    ## 株価コード・33セクター・17セクター・市場コードを並列に取得 (ウェアハウスへの反映は直列)
+    imports = {
+        "StockCode" : stock_code_import,
+        "Sector33Code" : sector_33_import,
+        "Sector17Code" : sector_17_import,
+        "MarketCode" : market_import,
+    }
+    with ThreadPoolExecutor(max_workers=len(imports)) as pool:
+        futures = {pool.submit(func, snowflake, jqapi, stage, format): name for name, func in imports.items()}
+        for future in as_completed(futures):
+            status = future.result()
+            print("----------------------- Complete %s Import: %s -----------------------" % (futures[future], status))
 
     ## ステージからファイルをリムーブ
-    snowflake.remove_stage(stage)
\ No newline at end of file
+    snowflake.remove_stage(stage)
@@ -6,103 +6,149 @@ import numpy as np
 import pandas as pd
 import yaml
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from snowflake.snowpark import Session
 from script.connect import Snowflake
-from script.connect import JQuants
+from script.connect import JQuants, report_task_states
+from script.warehouse import open_warehouse
+from script.streaming import IndicatorEngine, latest_path, state_path
+from script.watermark import Watermark
+
+## 前回取り込み分との重複取得期間 (遅延訂正・調整係数の変更を拾うための安全マージン)
+overlap_days = {
+    "financial" : int(os.environ.get("financial_overlap_days", 7)),
+    "stock" : int(os.environ.get("stock_overlap_days", 3)),
+}
 
 def finance_import(snowflake, jqapi, stage, format):
     ## Snowflake環境のインポート設定
-    tmp_path = './tmp_data/fin_update.csv'
     table = 'financial_update'
     pattern = '.*fin_update.csv.*'
 
-    ## 情報の取得
-    stock_fin = jqapi.get_financial(period=4)
+    ## 前回の取り込み上限以降の差分を取得し、取り込み済みと同一の行を除外
+    watermark = Watermark.load('financial', ['LocalCode', 'DisclosedDate'], 'DisclosedDate', overlap_days['financial'])
+    stock_fin = watermark.filter(jqapi.get_financial(period=4, since=watermark.start()))
+    if len(stock_fin) == 0:
+        return False
 
-    ## インポート用のCSVファイルをステージに転送
-    stock_fin.to_csv(tmp_path, index=False, encoding='utf8')
-    snowflake.put_stage(tmp_path, stage)
+    ## インポート用の圧縮CSVをメモリ上で作成してステージに転送 (分割して並列COPY)
+    snowflake.stage_frame(stock_fin, stage, 'fin_update.csv', files=4, encoding='utf8')
 
     ## データインポート
     snowflake.copy_table(table, stage, format, pattern)
 
-    ## ゴミ削除
-    os.remove(tmp_path)
+    ## 取り込み上限の更新
+    watermark.commit(stock_fin)
+    watermark.save()
+    return True
+
     # snowflake.truncate_table(table)
 
 def stock_import(snowflake, jqapi, stage, format):
     ## Snowflake環境のインポート設定
-    tmp_path = './tmp_data/stocks_value_update.csv'
     table = 'stock_update'
     pattern = '.*stocks_value_update.csv.*'
 
-    ## 情報の取得
-    stocks = jqapi.get_stock(period=10)
+    ## 前回の取り込み上限以降の差分を取得し、取り込み済みと同一の行を除外
+    watermark = Watermark.load('stock', ['Code', 'Date'], 'Date', overlap_days['stock'])
+    stocks = watermark.filter(jqapi.get_stock(period=10, since=watermark.start()))
+    if len(stocks) == 0:
+        return False
 
-    ## インポート用のCSVファイルをステージに転送
-    stocks.to_csv(tmp_path, index=False, encoding='cp932')
-    snowflake.put_stage(tmp_path, stage)
+    ## インポート用の圧縮CSVをメモリ上で作成してステージに転送 (分割して並列COPY)
+    snowflake.stage_frame(stocks, stage, 'stocks_value_update.csv', files=4, encoding='cp932')
 
     ## データインポート
     snowflake.copy_table(table, stage, format, pattern)
 
-    ## ゴミ削除
-    os.remove(tmp_path)
+    ## 取り込み上限の更新
+    watermark.commit(stocks)
+    watermark.save()
+
+    ## CANSLIM特徴量の更新 (失敗しても株価の取り込みは止めない)
+    ## 取り込み済みのバーは次回の差分に含まれないため、状態を破棄して次回は履歴から作り直す
+    try:
+        indicator_update(jqapi, stocks)
+    except Exception as e:
+        print("----------------------- Indicator Update Failed: %r -----------------------" % e)
+        if os.path.exists(state_path):
+            os.remove(state_path)
+    return True
+
     # snowflake.truncate_table(table)
 
+def indicator_update(jqapi, stocks):
+    ## 状態が無い場合は差分だけでは長期の指標が正しく計算できないため、ウォームアップ期間の株価から初期化
+    if os.path.exists(state_path):
+        ## 新しいバーのみで更新 (分割・併合のあった銘柄は調整後の履歴から作り直す)
+        engine = IndicatorEngine.load()
+        engine.update(stocks, history=jqapi.get_stock_history)
+    else:
+        engine = IndicatorEngine.from_history(jqapi)
+    engine.save()
+    engine.snapshot().to_pickle(latest_path)
+
 
 def topix_import(snowflake, jqapi, stage, format):
     ## Snowflake環境のインポート設定
-    tmp_path = './tmp_data/topix_value_update.csv'
     table = 'topix_update'
     pattern = '.*topix_value_update.csv.*'
 
     ## 情報の取得
     topix = jqapi.get_topix()
 
-    ## インポート用のCSVファイルをステージに転送
-    topix.to_csv(tmp_path, index=False, encoding='cp932')
-    snowflake.put_stage(tmp_path, stage)
+    ## インポート用の圧縮CSVをメモリ上で作成してステージに転送
+    snowflake.stage_frame(topix, stage, 'topix_value_update.csv', files=1, encoding='cp932')
 
     ## データインポート
     snowflake.copy_table(table, stage, format, pattern)
+    return True
 
-    ## ゴミ削除
-    os.remove(tmp_path)
     # snowflake.truncate_table(table)
 
 if __name__ == "__main__":
     print("----------------------- Job Start -----------------------")
     
-    ## Classの定義
-    snowflake = Snowflake()
-    jqapi = JQuants()
-
-    ## Taskの開始
-    snowflake.resume_task('stock_update_task')
-    snowflake.resume_task('financial_update_task')
-    snowflake.resume_task('topix_update_task')
+    ## Classの定義 (warehouse_backend=localでローカルのDuckDBに取り込み、J-Quantsへの同時リクエスト数は全データセット合計で制限)
+    snowflake = open_warehouse()
+    jqapi = JQuants(max_concurrency=4)
+
+    ## Taskの開始 (1回の往復でまとめて実行)
+    tasks = {
+        "Finance" : 'financial_update_task',
+        "Stock" : 'stock_update_task',
+        "Topix" : 'topix_update_task',
+    }
+    snowflake.resume_tasks(list(tasks.values()))
 
     print("----------------------- Complete Resume Task -----------------------")
 
     ## 各データのインポート
     stage = '@data_csv'
     format = 'file_csv'
-    finance_import(snowflake, jqapi, stage, format)
-    print("----------------------- Complete Finance Import -----------------------")
-
-    stock_import(snowflake, jqapi, stage, format)
-    print("----------------------- Complete Stock Import -----------------------")
-    
-    topix_import(snowflake, jqapi, stage, format)
-    print("----------------------- Complete Topix Import -----------------------")
-
-    ## ステージからファイルをリムーブ
-    snowflake.remove_stage(stage)
-
-    ## Taskの停止
-    time.sleep(90)
-    snowflake.suspend_task('stock_update_task')
-    snowflake.suspend_task('financial_update_task')
-    snowflake.suspend_task('topix_update_task')
+    ## 各データセットの取得・ステージ転送・COPYを並列に実行
+    ## (先に取得が終わったデータセットのCOPYと、他データセットの取得が重なる)
+    imports = {
+        "Finance" : finance_import,
+        "Stock" : stock_import,
+        "Topix" : topix_import,
+    }
+    since = {}
+    with ThreadPoolExecutor(max_workers=len(imports)) as pool:
+        futures = {pool.submit(func, snowflake, jqapi, stage, format): name for name, func in imports.items()}
+        for future in as_completed(futures):
+            name = futures[future]
+            ## COPY完了後に開始したTaskの実行を待つ (取り込みが無ければ待たずに停止)
+            if future.result():
+                since[tasks[name]] = snowflake.current_timestamp()
+            print("----------------------- Complete %s Import -----------------------" % name)
+
+    ## ステージからファイルをリムーブ・取り込みの無かったTaskの停止 (互いに依存しないので非同期に実行)
+    snowflake.remove_stage(stage, wait=False)
+    snowflake.suspend_tasks([task for task in tasks.values() if task not in since], wait=False)
+
+    ## Taskの停止 (実行が完了したTaskから順に停止)
+    states = snowflake.wait_tasks(since)
+    snowflake.wait_pending()
+    report_task_states(states)
     print("----------------------- Complete Suspend Task -----------------------")
@@ -1,14 +1,70 @@
+import os
+import sys
 import pandas as pd
 import numpy as np
 import datetime
-import copy
+
+# python script/backtest.py としてリポジトリのルートから実行した場合もscriptパッケージを参照できるようにする
+if __name__ == '__main__' and not __package__:
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from script.chunked import build_features, feature_dataset_path
+from script.features import GroupedPanel, canslim_features, rank_features
+from script.feature_cache import FeatureCache
+from script.fundamentals import attach_fundamentals
+from script.loader import exists_dataset, read_dataset, exists_warehouse, read_warehouse, read_statements
+from script.result import ResultBuffer, result_path
+from script.rules import Strategy, col, compile_rules
 
 
 data_path = "/Users/smurakawa/src/portfolio/data/data/stock_df_dev.pkl"
 
+# feature_engineeringで残す特徴量の列
+output_features = ['UP_MATCH_COND_NUM','UP_MATCH_COND_TREND','UD_RATIO','RS_RATING','SECTOR_RS','SECTOR_RANK']
+
+feature_dtypes = {
+    "CODE" : "category"
+    ,"SECTOR33CODENAME" : "category"
+    ,"CLOSE" : "float64"
+    ,"UP_MATCH_COND_NUM" : "int8"
+    ,"UP_MATCH_COND_TREND" : "int8"
+}
+
+
+def signal_to_position(entries, exits, initial=0):
+    # エントリー/エグジットのどちらか一方のみ成立するバーでポジションが確定し、
+    # 両方成立するバーでは直前のポジションが反転する (ループ版の売買判定と同じ挙動)
+    # 2次元配列(バー x パラメータ)を渡すと列ごとに独立して計算する
+    n = len(entries)
+    both = entries & exits
+    decisive = entries ^ exits
+    bars = np.arange(n, dtype=np.int32).reshape((n,) + (1,) * (entries.ndim - 1))
+    last = np.maximum.accumulate(np.where(decisive, bars, -1), axis=0)
+    has_last = last >= 0
+    last = np.maximum(last, 0)
+
+    base = np.where(has_last, np.take_along_axis(entries, last, axis=0), bool(initial))
+    flips = np.cumsum(both, axis=0, dtype=np.int32)
+    flips = flips - np.where(has_last, np.take_along_axis(flips, last, axis=0), 0)
+
+    return (base.astype(np.int8) ^ (flips & 1)).astype(np.int8)
+
+
+def order_by_code(data):
+    # 銘柄の出現順に並べ替え (銘柄内の行順は維持)
+    code_ids, _ = pd.factorize(data["CODE"])
+    order = np.argsort(code_ids, kind="stable")
+    return data.iloc[order], order
+
+
+def format_dates(dates):
+    # get_date_priceと同じ'YYYY-MM-DD'形式の文字列配列
+    return np.datetime_as_string(pd.to_datetime(dates).values.astype("datetime64[D]"))
+
+
 class BacktestBase(object):
     def __init__(self, start,end,amount,
-                    ftc=0.0,ptc=0.0,verbose=True):
+                    ftc=0.0,ptc=0.0,verbose=True,result_format="parquet"):
         self.start = start
         self.end = end
         self.initial_amount = amount
@@ -27,6 +83,7 @@ class BacktestBase(object):
         self.total_ret = 0
         self.daily_ret = []
         self.verbose = verbose
+        self.result_format = result_format
     
     def get_date_price(self, bar, df):
         date = str(df.index[bar])[:10]
@@ -83,210 +140,257 @@ class BacktestBase(object):
         self.total_ret += ret
 
 
+    def metrics(self):
+        closed_trades = self.win_trades + self.lose_trades
+        win_rate = self.win_trades / closed_trades if closed_trades else np.nan
+        avg_ret = (self.amount - self.initial_amount) / closed_trades if closed_trades else np.nan
+        if self.win_trades and self.lose_trades:
+            payoff_ratio = abs(self.win_amount / self.win_trades) / abs(self.lose_amount / self.lose_trades)
+        else:
+            payoff_ratio = np.nan
+
+        return {
+            "final_balance" : float(self.amount),
+            "total_return" : float(self.total_ret),
+            "net_performance" : float((self.amount - self.initial_amount) / self.initial_amount),
+            "trades" : self.trades,
+            "win_trades" : self.win_trades,
+            "lose_trades" : self.lose_trades,
+            "win_rate" : win_rate,
+            "avg_return" : float(avg_ret),
+            "payoff_ratio" : float(payoff_ratio),
+        }
+
+
     def close_out(self, bar, df):
         date, price = self.get_date_price(bar, df)
         self.amount += self.units * price
         self.units = 0
         self.trades += 1
+        self.print_metrics()
+
 
+    def print_metrics(self):
+        metrics = self.metrics()
         print('Final balance [¥] {:.2f}'.format(self.amount))
         print('Total Return [¥] {:.2f}'.format(self.total_ret))
-
-        pref = ((self.amount - self.initial_amount) / self.initial_amount)
-        print(f'Net Performance [%] {pref:.2f}')
+        print('Net Performance [%] {:.2f}'.format(metrics["net_performance"]))
         print('Total Trades {:.2f}'.format(self.trades))
         print('Win Trades {:.2f}'.format(self.win_trades))
-
-        win_rate = self.win_trades / (self.win_trades + self.lose_trades)
-        print('Win Rate [%] {:.2f}'.format(win_rate))
-
-        avg_ret = (((self.amount - self.initial_amount) / (self.win_trades + self.lose_trades)))
-        print('Avg Return {:.2f}'.format(avg_ret))
-
-        payoff_ratio = abs(self.win_amount / self.win_trades) / abs(self.lose_amount / self.lose_trades)
-        print('Payoff Ratio {:.2f}'.format(payoff_ratio))
+        print('Win Rate [%] {:.2f}'.format(metrics["win_rate"]))
+        print('Avg Return {:.2f}'.format(metrics["avg_return"]))
+        print('Payoff Ratio {:.2f}'.format(metrics["payoff_ratio"]))
 
 
 class BacktestCanslimTrade(BacktestBase):
-    def get_data_from_master_stock(self):
-        df = pd.read_pickle(data_path)
-        df = df[["DATE","CODE","COMPANYNAME","SECTOR33CODENAME","SECTOR17CODENAME","CLOSE","VOLUME"]]
-        df.DATE = pd.to_datetime(df.DATE)
+    def get_data_from_master_stock(self, lookback_days=400):
+        # 特徴量のウォームアップ分(52週+α)だけ開始日を遡って読み込む
+        columns = ["DATE","CODE","COMPANYNAME","SECTOR33CODENAME","SECTOR17CODENAME","CLOSE","VOLUME"]
+        start = pd.Timestamp(self.start) - pd.Timedelta(days=lookback_days)
+        end = pd.Timestamp(self.end)
+
+        if exists_warehouse():
+            df = read_warehouse(columns=columns, start=start, end=end)
+        elif exists_dataset():
+            df = read_dataset(columns=columns, start=start, end=end)
+        else:
+            df = pd.read_pickle(data_path)
+            df = df[columns]
+            df.DATE = pd.to_datetime(df.DATE)
+            df = df[(df.DATE >= start) & (df.DATE <= end)]
+
         df['DATE_YEAR'] = df.DATE.dt.year
         df = df.astype({'DATE_YEAR' : str})
 
         return df
 
 
-    def feature_engineering(self, df):
-        # CANSLIM基礎特徴料作成
-        df["MA_50"] = df.sort_values(by=['DATE'],ascending=True).groupby(['CODE'])['CLOSE'] \
-                        .rolling(51, min_periods=1).mean().reset_index(drop=True, level=0)
+    def get_statements(self, lookback_days=800):
+        # 前年比の計算に2年分以上の決算が必要 (ローカルの分析用データベースが無い場合はNone)
+        if not exists_warehouse():
+            return None
+        start = pd.Timestamp(self.start) - pd.Timedelta(days=lookback_days)
+        return read_statements(start=start, end=pd.Timestamp(self.end))
 
-        df["MA_150"] = df.sort_values(by=['DATE'],ascending=True).groupby(['CODE'])['CLOSE']\
-                        .rolling(151, min_periods=1).mean().reset_index(drop=True, level=0)
 
-        df["MA_200"] = df.sort_values(by=['DATE'],ascending=True).groupby(['CODE'])['CLOSE']\
-                        .rolling(201, min_periods=1).mean().reset_index(drop=True, level=0)
+    def trim_period(self, df):
+        # ウォームアップ期間を除いたバックテスト期間のみ残す
+        return df[(df.DATE >= pd.Timestamp(self.start)) & (df.DATE <= pd.Timestamp(self.end))]
 
-        df["LOW_52"] = df.sort_values(by=['DATE'],ascending=True).groupby(['CODE'])['CLOSE']\
-                        .rolling(53, min_periods=1).min().reset_index(drop=True, level=0)
 
-        df["HIGH_52"] = df.sort_values(by=['DATE'],ascending=True).groupby(['CODE'])['CLOSE']\
-                        .rolling(53, min_periods=1).max().reset_index(drop=True, level=0)
+    def compute_features(self, df, panel, params=None, cross_section=True):
+        # (CODE, DATE)でソート済みの配列として出力列の特徴量を計算
+        # cross_section=Falseの場合は銘柄単位の特徴量と、順位付け前のRSを返す
+        close = panel.take(df["CLOSE"]).astype(np.float64)
+        volume = panel.take(df["VOLUME"]).astype(np.float64)
+        sector_ids = panel.take(pd.factorize(df["SECTOR33CODENAME"])[0]) if cross_section and "SECTOR33CODENAME" in df else None
+        features = canslim_features(panel, close, volume, params, sector_ids=sector_ids, cross_section=cross_section)
+        columns = output_features if cross_section else [col for col in output_features if col not in rank_features] + ["RSI"]
+        return {col: features[col] for col in columns if col in features}
 
-        df['LAG_63'] = df.sort_values(by=['DATE'],ascending=True).groupby(['CODE'])['CLOSE'].pct_change(63)
-        df['LAG_126'] = df.sort_values(by=['DATE'],ascending=True).groupby(['CODE'])['CLOSE'].pct_change(126)
-        df['LAG_189'] = df.sort_values(by=['DATE'],ascending=True).groupby(['CODE'])['CLOSE'].pct_change(189)
-        df['LAG_252'] = df.sort_values(by=['DATE'],ascending=True).groupby(['CODE'])['CLOSE'].pct_change(252)
-        df["RSI"] = ((df['LAG_63'] * 0.4) +  (df['LAG_126'] * 0.2) + (df['LAG_189'] * 0.2) + (df['LAG_252'] * 0.2)) * 100
 
-        # UD_RATIO計算メソッド
-        df["LAG_1_VOLUME"] = df.sort_values(by=['DATE'],ascending=True).groupby(['CODE'])['VOLUME'].pct_change(1)
+    def feature_engineering(self, df, params=None, statements=None, cache=None):
+        # (CODE, DATE)で一度だけソートし、銘柄ごとの連続区間で特徴量を計算
+        # cache (FeatureCache) を渡すと同じ入力・パラメータの特徴量は保存済みの値を使う
+        panel = GroupedPanel(df["CODE"], df["DATE"])
+        if cache is None:
+            features = self.compute_features(df, panel, params)
+        else:
+            features = cache.features(df, panel, params, self.compute_features)
 
-        ud_ratio_df = copy.deepcopy(df[["DATE", "CODE", "LAG_1_VOLUME"]])
-        ud_ratio_df["VOL_PLUS"] = np.where(df["LAG_1_VOLUME"] >= 0, df["VOLUME"], 0)
-        ud_ratio_df["VU"] = ud_ratio_df.sort_values(by=['DATE'],ascending=True).groupby(['CODE'])['VOL_PLUS']\
-                                .rolling(53, min_periods=1).sum().reset_index(drop=True, level=0)
+        # 不要カラムの削除
+        df = df[['DATE','CODE','SECTOR33CODENAME','CLOSE']]
+        df = df.assign(**{col: panel.restore(values) for col, values in features.items()})
+        # 決算短信を渡した場合は各取引日時点で開示済みの成長率 (CANSLIMのC・A) を結合
+        if statements is not None:
+            df = attach_fundamentals(df, statements)
 
-        ud_ratio_df["VOL_MINUS"] = np.where(df["LAG_1_VOLUME"] <= 0, df["VOLUME"], 0)
-        ud_ratio_df["VD"] = ud_ratio_df.sort_values(by=['DATE'],ascending=True).groupby(['CODE'])['VOL_MINUS']\
-                                .rolling(53, min_periods=1).sum().reset_index(drop=True, level=0)
+        df = df.astype(feature_dtypes)
 
-        df["UD_RATIO"] = ud_ratio_df["VU"] / ud_ratio_df["VD"]
-        df.UD_RATIO = df.UD_RATIO.replace([np.inf, -np.inf], 0)
-        df.UD_RATIO = df.UD_RATIO.fillna(0)
-        del ud_ratio_df
+        return df
 
-        # CANSLIM上昇トレンド判定メソッド
-        df["UP_COND1"] = np.where((df.CLOSE > df.MA_150) & (df.CLOSE > df.MA_200), 1, 0 )
-        df["UP_COND2"] = np.where(df.MA_150 > df.MA_200, 1, 0 )
-        df["UP_COND4"] = np.where((df.MA_50 > df.MA_150) & (df.MA_50 > df.MA_200), 1, 0 )
-        df["UP_COND5"] = np.where((df.CLOSE > df.MA_50), 1, 0 )
-        df["UP_COND6"] = np.where(df.CLOSE > df.LOW_52 * 1.3, 1, 0 )
-        df["UP_COND7"] = np.where(df.CLOSE > df.HIGH_52 * 0.75, 1, 0 )
-        df["UP_COND8"] = np.where(df.RSI > 1.7 , 1, 0 )
-        df["UP_MATCH_COND_NUM"] = df.UP_COND1 + df.UP_COND2 + df.UP_COND4 \
-                                        + df.UP_COND5 + df.UP_COND6 + df.UP_COND7 + df.UP_COND8
-        df["UP_MATCH_COND_TREND"] = np.where((df.UP_COND1 == 1) & (df.UP_COND4 == 1) & \
-                                                (df.UP_COND5 == 1) & (df.UP_COND6 == 1), 1, 0 )
 
-        # 不要カラムの削除
-        df = df[['DATE','CODE','SECTOR33CODENAME','CLOSE','UP_MATCH_COND_NUM','UP_MATCH_COND_TREND','UD_RATIO']]
-        df = df.astype({
-            "CLOSE" : "float16"
-            ,"UP_MATCH_COND_NUM" : "int8"
-            ,"UP_MATCH_COND_TREND" : "int8"
-        })
+    def feature_engineering_out_of_core(self, reader, path=feature_dataset_path, params=None, statements=None,
+                                        memory_budget=2 * 1024 ** 3, lookback_days=400):
+        # パネル全体をメモリに載せず、銘柄シャードごとに計算してpathのデータセットに書き出す (結果はread_featuresで読み込み)
+        # reader: read_dataset / read_warehouseと同じ引数 (columns, start, end, codes) で入力を返す関数
+        start = pd.Timestamp(self.start) - pd.Timedelta(days=lookback_days) if self.start else None
+        end = pd.Timestamp(self.end) if self.end else None
 
-        return df
+        def finish(df, features):
+            df = df[['DATE','CODE','SECTOR33CODENAME','CLOSE']].assign(**{col: features[col] for col in output_features if col in features})
+            if statements is not None:
+                df = attach_fundamentals(df, statements)
+            return df
 
-    def cumsum_ret(self, code, date):
-        return self.daily_ret.append([code, date, self.total_ret])
+        return build_features(reader, self.compute_features, finish, path, params=params, start=start, end=end, memory_budget=memory_budget)
 
 
-    def run_trend_1_and_match_num_over_5(self, data):
-        print('----------------------- Start Run Strategy run_trend_1_and_match_num_over_6 ----------------------------')
+    def read_features(self, path=feature_dataset_path, columns=None, codes=None):
+        # feature_engineering_out_of_coreの結果をバックテスト期間・銘柄で絞り込んで読み込む
+        df = read_dataset(path, columns=columns, start=self.start, end=self.end, codes=codes)
+        df = df.drop(columns="YEAR", errors="ignore")
+        return df.astype({col: dtype for col, dtype in feature_dtypes.items() if col in df})
 
-        codes = data.CODE.unique()
-        for code in codes:
-            df = data[data["CODE"]==code]
-            df = df.set_index("DATE")
+    def run_signal(self, data, entries, exits, result=None):
+        data, order = order_by_code(data)
+        position = signal_to_position(np.asarray(entries, dtype=bool)[order],
+                                      np.asarray(exits, dtype=bool)[order], self.position)
+        self.run_position(data, position, result)
 
-            for bar in range(0, len(df)):
-                date, price = self.get_date_price(bar, df)
-                if self.position == 0:
-                    if df["UP_MATCH_COND_TREND"].iloc[bar] == 1 and df["UP_MATCH_COND_NUM"].iloc[bar] > 4:
-                        self.place_buy_order(date, price, amount=self.amount)
-                        self.position = 1
 
-                elif self.position == 1:
-                    if df["UP_MATCH_COND_TREND"].iloc[bar] == 0 or df["UP_MATCH_COND_NUM"].iloc[bar] <= 4:
-                        self.place_sell_order(date, price, units=self.units)
-                        self.position = 0
+    def run_position(self, data, position, result=None):
+        # 売買が発生するバーのみ約定処理 (dataは銘柄の出現順に並んでいること)
+        trade_bars = np.flatnonzero(np.diff(position, prepend=self.position))
+        close = data["CLOSE"].values
+        dates = format_dates(data["DATE"])
 
-                self.cumsum_ret(code, date)
+        total_ret = np.full(len(data), np.nan)
+        start_ret = self.total_ret
+        for bar in trade_bars:
+            if position[bar] == 1:
+                self.place_buy_order(dates[bar], close[bar], amount=self.amount)
+            else:
+                self.place_sell_order(dates[bar], close[bar], units=self.units)
+                total_ret[bar] = self.total_ret
+        self.position = int(position[-1])
 
-        self.close_out(bar, df)
-        print('----------------------- End Run Strategy run_trend_1_and_match_num_over_6 ----------------------------')
+        # 日次の累積リターン (resultを渡した場合は列バッファ経由でファイルに書き出す)
+        daily_ret = {
+            "code" : data["CODE"].values,
+            "date" : dates,
+            "return" : pd.Series(total_ret).ffill().fillna(start_ret).values,
+        }
+        if result is None:
+            self.daily_ret = pd.DataFrame(daily_ret)
+        else:
+            result.extend(daily_ret)
+            self.daily_ret = result
 
-        result_df = pd.DataFrame(self.daily_ret, columns=["code", "date", "return"])
-        result_df.to_csv("./backtest_result/run_trend_1_and_match_num_over_5.csv", index=False)
+        self.close_out(0, data.iloc[[-1]].set_index("DATE"))
 
 
-    def run_match_num_over_2(self, data):
-        print('----------------------- Start Run Strategy run_match_num_over_2 ----------------------------')
+    def run_strategy(self, name, data, signals=None):
+        print('----------------------- Start Run Strategy %s ----------------------------' % name)
 
-        codes = data.CODE.unique()
-        for code in codes:
-            df = data[data["CODE"]==code]
-            df = df.set_index("DATE")
+        signals = signals or strategies[name](data)
+        with ResultBuffer(result_path(name, self.result_format), format=self.result_format) as result:
+            self.run_signal(data, *signals, result)
+        print('----------------------- End Run Strategy %s ----------------------------' % name)
 
-            for bar in range(0, len(df)):
-                date, price = self.get_date_price(bar, df)
-                if self.position == 0:
-                    if df["UP_MATCH_COND_NUM"].iloc[bar] > 2:
-                        self.place_buy_order(date, price, amount=self.amount)
-                        self.position = 1
 
-                elif self.position == 1:
-                    if df["UP_MATCH_COND_NUM"].iloc[bar] <= 2:
-                        self.place_sell_order(date, price, units=self.units)
-                        self.position = 0
+    def run_strategies(self, names, data):
+        # 複数の戦略の条件を1度の評価にまとめ (共通部分式は1回のみ計算)、戦略ごとに約定処理
+        signals = compile_rules(strategies, names).run(data)
+        for name in names:
+            self.run_strategy(name, data, signals[name])
 
-                self.cumsum_ret(code, date)
 
-        self.close_out(bar, df)
-        print('----------------------- End Run Strategy run_match_num_over_2 ----------------------------')
+    def run_trend_1_and_match_num_over_5(self, data):
+        self.run_strategy("run_trend_1_and_match_num_over_5", data)
 
-        result_df = pd.DataFrame(self.daily_ret, columns=["code", "date", "return"])
-        result_df.to_csv("./backtest_result/run_match_num_over_2.csv", index=False)
+
+    def run_match_num_over_2(self, data):
+        self.run_strategy("run_match_num_over_2", data)
 
 
     def run_udratio_over_1(self, data):
-        print('----------------------- Start Run Strategy run_udratio_over_1 ----------------------------')
+        self.run_strategy("run_udratio_over_1", data)
+
 
-        codes = data.CODE.unique()
-        for code in codes:
-            df = data[data["CODE"]==code]
-            df = df.set_index("DATE")
+    def run_rs_rating_over_80(self, data):
+        self.run_strategy("run_rs_rating_over_80", data)
 
-            for bar in range(0, len(df)):
-                date, price = self.get_date_price(bar, df)
-                if self.position == 0:
-                    if df["UD_RATIO"].iloc[bar] >= 1:
-                        self.place_buy_order(date, price, amount=self.amount)
-                        self.position = 1
 
-                elif self.position == 1:
-                    if df["UD_RATIO"].iloc[bar] < 1 or df["UP_MATCH_COND_NUM"].iloc[bar] <= 4:
-                        self.place_sell_order(date, price, units=self.units)
-                        self.position = 0
+# 戦略はエントリー・エグジット条件を特徴量の列の式で宣言する (評価はscript.rules.Programでまとめて実行)
+def trend_1_and_match_num_over_5(num=4):
+    trend, match = col("UP_MATCH_COND_TREND"), col("UP_MATCH_COND_NUM")
+    return (trend == 1) & (match > num), (trend == 0) | (match <= num)
 
-                self.cumsum_ret(code, date)
 
-        self.close_out(bar, df)
-        print('----------------------- End Run Strategy run_udratio_over_1 ----------------------------')
+def match_num_over_2(num=2):
+    match = col("UP_MATCH_COND_NUM")
+    return match > num, match <= num
 
-        result_df = pd.DataFrame(self.daily_ret, columns=["code", "date", "return"])
-        result_df.to_csv("./backtest_result/run_udratio_over_1.csv", index=False)
 
+def udratio_over_1(ud=1, num=4):
+    ud_ratio = col("UD_RATIO")
+    return ud_ratio >= ud, (ud_ratio < ud) | (col("UP_MATCH_COND_NUM") <= num)
+
+
+def rs_rating_over_80(rating=80, sector_rank=11, margin=10):
+    # 上昇トレンドかつ全銘柄中のRS上位 (上位1/3のセクター内) でエントリー、RSがmargin分落ちたらエグジット
+    trend, rs_rating = col("UP_MATCH_COND_TREND"), col("RS_RATING")
+    entries = (trend == 1) & (rs_rating >= rating) & col("SECTOR_RANK").between(1, sector_rank)
+    exits = (trend == 0) | (rs_rating < rating - margin)
+    return entries, exits
+
+
+# 戦略名 -> (エントリー, エグジット)条件
+strategies = {
+    "run_trend_1_and_match_num_over_5" : Strategy(trend_1_and_match_num_over_5),
+    "run_udratio_over_1" : Strategy(udratio_over_1),
+    "run_match_num_over_2" : Strategy(match_num_over_2),
+    "run_rs_rating_over_80" : Strategy(rs_rating_over_80),
+}
 
 if __name__ == '__main__':
     dt_now = datetime.datetime.now()
     print('------------- Script Start at %s -------------' % dt_now)
     bct = BacktestCanslimTrade('2021-01-01','2022-12-31',1000,ftc=0.0,ptc=0.0,verbose=False)
     df = bct.get_data_from_master_stock()
-    df = bct.feature_engineering(df)
-
-    bct = BacktestCanslimTrade('2021-01-01','2022-12-31',1000,ftc=0.0,ptc=0.0,verbose=False)
-    bct.run_trend_1_and_match_num_over_5(df)
-
-    bct = BacktestCanslimTrade('2021-01-01','2022-12-31',1000,ftc=0.0,ptc=0.0,verbose=False)
-    bct.run_udratio_over_1(df)
-
-    bct = BacktestCanslimTrade('2021-01-01','2022-12-31',1000,ftc=0.0,ptc=0.0,verbose=False)
-    bct.run_match_num_over_2(df)
+    df = bct.trim_period(bct.feature_engineering(df, statements=bct.get_statements(), cache=FeatureCache()))
+
+    # 戦略 x 銘柄シャードをプロセスプールで並列実行
+    from script.runner import run_parallel
+    summary = run_parallel(df, list(strategies), '2021-01-01', '2022-12-31', 1000, ftc=0.0, ptc=0.0)
+    print(summary.to_string(index=False))
+
+    # 全銘柄で1つの口座を共有した日付順のポートフォリオシミュレーション
+    from script.portfolio import BacktestPortfolio
+    for name in strategies:
+        bpt = BacktestPortfolio('2021-01-01','2022-12-31',1000000,ftc=0.0,ptc=0.0,verbose=False)
+        bpt.run_portfolio(df, name, max_positions=10, score="UD_RATIO")
 
     dt_now = datetime.datetime.now()
     print('------------- Script End at %s -------------' % dt_now)
@@ -0,0 +1,124 @@
+import contextlib
+import fcntl
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+
+
+cache_dir = "./metadata/jquants_cache"
+
+
+class ResponseCache(object):
+    # APIレスポンスをエンドポイント・引数ごとにParquetで保存するキャッシュ
+    # ttl=Noneは無期限 (確定済みの過去データ)、容量を超えた場合は最終アクセスの古い順に削除する
+    # 複数のプロセス (マスタ・日次の取り込み、バックフィルなど) で共有するため、索引はロックファイルで排他して毎回読み直す
+    def __init__(self, directory=cache_dir, max_bytes=2 * 1024 ** 3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(directory, "index.json")
+        self.lock_path = os.path.join(directory, "index.lock")
+        self.lock = threading.Lock()
+        self.index = {}
+        self.load_index()
+
+    def key(self, endpoint, *args, **kwargs):
+        text = json.dumps([endpoint, [str(arg) for arg in args], {k: str(v) for k, v in sorted(kwargs.items())}])
+        return hashlib.sha1(text.encode("utf8")).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, "%s.parquet" % key)
+
+    @contextlib.contextmanager
+    def locked(self):
+        # スレッド間はself.lock、プロセス間はロックファイルで排他し、他のプロセスが更新した索引を読み直す
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.lock_path, "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self.load_index()
+                yield
+
+    def get(self, key):
+        with self.locked():
+            entry = self.index.get(key)
+            if entry is None:
+                return None
+            if entry["expires"] is not None and entry["expires"] < time.time():
+                self.remove(key)
+                self.save_index()
+                return None
+            # 読み込みもロック内で行い、ファイルが無ければキャッシュなしとして扱う
+            try:
+                df = pd.read_parquet(self.path(key))
+            except FileNotFoundError:
+                self.remove(key)
+                self.save_index()
+                return None
+            entry["accessed"] = time.time()
+            self.save_index()
+        return df
+
+    def put(self, key, df, ttl=None):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self.path(key) + ".%d.%d.tmp" % (os.getpid(), threading.get_ident())
+        df.to_parquet(tmp_path, index=False, compression="zstd")
+
+        # ファイルの配置と索引への追加はロック内で行う (他のプロセスのevictで索引に無いファイルとして削除されないように)
+        with self.locked():
+            os.replace(tmp_path, self.path(key))
+            now = time.time()
+            self.index[key] = {
+                "size" : os.path.getsize(self.path(key)),
+                "expires" : None if ttl is None else now + ttl,
+                "accessed" : now,
+            }
+            self.evict()
+            self.save_index()
+
+    def remove(self, key):
+        self.index.pop(key, None)
+        if os.path.exists(self.path(key)):
+            os.remove(self.path(key))
+
+    def evict(self):
+        # 期限切れを削除した後、容量上限まで最終アクセスの古い順に削除
+        now = time.time()
+        for key in [key for key, entry in self.index.items() if entry["expires"] is not None and entry["expires"] < now]:
+            self.remove(key)
+
+        total = sum(entry["size"] for entry in self.index.values())
+        for key in sorted(self.index, key=lambda key: self.index[key]["accessed"]):
+            if total <= self.max_bytes:
+                break
+            total -= self.index[key]["size"]
+            self.remove(key)
+
+        # 索引に無いファイル (索引の更新が失われたもの) は容量に数えられないため削除
+        for path in glob.glob(os.path.join(self.directory, "*.parquet")):
+            if os.path.basename(path)[:-len(".parquet")] not in self.index:
+                os.remove(path)
+
+    def load_index(self):
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as file:
+                self.index = json.load(file)
+
+    def save_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self.index_path + ".%d.tmp" % os.getpid()
+        with open(tmp_path, "w") as file:
+            json.dump(self.index, file)
+        os.replace(tmp_path, self.index_path)
+
+    def clear(self):
+        with self.locked():
+            for key in list(self.index):
+                self.remove(key)
+            self.evict()
+            self.save_index()
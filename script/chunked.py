@@ -0,0 +1,96 @@
+import gc
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from script.features import GroupedPanel, cross_sectional_ranks
+from script.loader import partitioning
+
+
+feature_dataset_path = "./metadata/features"
+
+# 特徴量の計算で1行あたりに使うメモリの目安 (入力列・ソート用の添字・中間配列・出力列の合計、実測値)
+# memory_budgetはシャード1つ分の処理に使うメモリで、インタプリタ自体や銘柄一覧の読み込み分は含まない
+bytes_per_row = 640
+
+
+def split_by_rows(counts, max_rows):
+    # countsの順序を保ったまま、行数の合計がmax_rowsを超えないようにキーをまとめる (1キーで超える場合は単独)
+    groups, group, rows = [], [], 0
+    for key, count in counts.items():
+        if group and rows + count > max_rows:
+            groups.append(group)
+            group, rows = [], 0
+        group.append(key)
+        rows += count
+    if group:
+        groups.append(group)
+    return groups
+
+
+def build_features(reader, compute, finish, path, params=None, start=None, end=None, memory_budget=2 * 1024 ** 3,
+                   input_columns=("DATE", "CODE", "SECTOR33CODENAME", "CLOSE", "VOLUME")):
+    # 1. 銘柄シャードごとに銘柄単位の特徴量と順位付け前のRSを計算して一時ファイルに書き出す
+    # 2. 日付の範囲ごとにRSを読み直してクロスセクションの順位を計算 (日付ごとに独立)
+    # 3. 銘柄シャードごとに順位を結合し、年パーティションのデータセットとしてpathに書き出す
+    # いずれの段階もメモリ上の行数はmemory_budget / bytes_per_row以下
+    max_rows = max(1, int(memory_budget // bytes_per_row))
+    work = path + "_work"
+    for directory in [path, work]:
+        shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(os.path.join(work, "shards"))
+    os.makedirs(os.path.join(work, "ranks"))
+
+    counts = reader(columns=["CODE"], start=start, end=end)["CODE"].astype(str).value_counts().sort_index()
+    shards = split_by_rows(counts, max_rows)
+    del counts
+
+    date_counts = pd.Series(dtype=np.int64)
+    for i, codes in enumerate(shards):
+        df = reader(columns=list(input_columns), start=start, end=end, codes=codes)
+        df["DATE"] = pd.to_datetime(df["DATE"])
+        panel = GroupedPanel(df["CODE"], df["DATE"])
+        features = compute(df, panel, params, cross_section=False)
+
+        frame = df.iloc[panel.order][[col for col in input_columns if col != "VOLUME"]].reset_index(drop=True)
+        frame = frame.assign(**features)
+        frame.to_parquet(os.path.join(work, "shards", "%d.parquet" % i), index=False)
+        date_counts = date_counts.add(frame["DATE"].value_counts(), fill_value=0)
+        del df, panel, features, frame
+        gc.collect()
+
+    shard_data = ds.dataset(os.path.join(work, "shards"), format="parquet")
+    rank_columns = [col for col in ["DATE", "CODE", "SECTOR33CODENAME", "RSI"] if col in shard_data.schema.names]
+    for j, dates in enumerate(split_by_rows(date_counts.sort_index().astype(np.int64), max_rows)):
+        expr = (ds.field("DATE") >= dates[0].to_pydatetime()) & (ds.field("DATE") <= dates[-1].to_pydatetime())
+        df = shard_data.to_table(columns=rank_columns, filter=expr).to_pandas()
+        panel = GroupedPanel(df["CODE"], df["DATE"])
+        sector_ids = panel.take(pd.factorize(df["SECTOR33CODENAME"])[0]) if "SECTOR33CODENAME" in df else None
+        ranks = cross_sectional_ranks(panel, panel.take(df["RSI"]).astype(np.float64), sector_ids)
+
+        frame = df.iloc[panel.order][["CODE", "DATE"]].reset_index(drop=True).assign(**ranks)
+        frame.to_parquet(os.path.join(work, "ranks", "%d.parquet" % j), index=False)
+        del df, panel, ranks, frame
+        gc.collect()
+
+    rank_data = ds.dataset(os.path.join(work, "ranks"), format="parquet")
+    for i, codes in enumerate(shards):
+        frame = pd.read_parquet(os.path.join(work, "shards", "%d.parquet" % i))
+        ranks = rank_data.to_table(filter=ds.field("CODE").isin(codes)).to_pandas()
+        frame = frame.merge(ranks, on=["CODE", "DATE"], how="left")
+        features = {col: frame[col].values for col in frame.columns if col not in input_columns and col != "RSI"}
+
+        df = finish(frame, features)
+        df["YEAR"] = df["DATE"].dt.year.astype("int16")
+        ds.write_dataset(pa.Table.from_pandas(df, preserve_index=False), path, format="parquet", partitioning=partitioning,
+                         basename_template="shard-%d-{i}.parquet" % i, existing_data_behavior="overwrite_or_ignore",
+                         max_rows_per_group=256 * 1024)
+        del frame, ranks, features, df
+        gc.collect()
+
+    shutil.rmtree(work, ignore_errors=True)
+    return path
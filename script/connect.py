@@ -6,133 +6,398 @@ import numpy as np
 import pandas as pd
 import yaml
 import time
+import io
+import functools
+import json
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
 from snowflake.snowpark import Session
+from script.cache import ResponseCache
+from script.schema import normalize, snowflake_schema
+
+
+# APIのキャッシュ有効期間 (秒)。マスタ系以外の確定済みの日付範囲のデータは無期限でキャッシュ
+# 株価は分割・併合時に過去日のAdjustment*列が書き換わるため、確定済みの範囲でも期限付き
+cache_ttl = {
+    "get_listed_info" : 24 * 3600,
+    "get_listed_sections" : 7 * 24 * 3600,
+    "get_17_sectors" : 7 * 24 * 3600,
+    "get_33_sectors" : 7 * 24 * 3600,
+    "get_market_segments" : 7 * 24 * 3600,
+    "get_indices_topix" : 3600,
+    "get_price_range" : 24 * 3600,
+}
+
+
+def call_with_backoff(func, *args, retries=5, backoff=1.0, max_backoff=60.0, **kwargs):
+    # レート制限(429)・サーバーエラー(5xx)・通信エラーは指数バックオフで再試行
+    for attempt in range(retries + 1):
+        try:
+            return func(*args, **kwargs)
+        except requests.exceptions.RequestException as e:
+            response = getattr(e, "response", None)
+            status = response.status_code if response is not None else None
+            if attempt == retries or (status is not None and status != 429 and status < 500):
+                raise
+
+            wait = min(max_backoff, backoff * 2 ** attempt) * (1 + random.random())
+            if response is not None and response.headers.get("Retry-After", "").isdigit():
+                wait = float(response.headers["Retry-After"])
+            time.sleep(wait)
+
+
+# Taskの実行履歴のうち完了とみなす状態
+# SKIPPEDはWHEN条件が不成立 (ストリームに新しい行が無い) で実行されなかったもので、失敗とは区別する
+task_done_states = ('SUCCEEDED', 'SKIPPED')
+task_failed_states = ('FAILED', 'CANCELLED', 'FAILED_AND_AUTO_SUSPENDED')
+
+
+
+def report_task_states(states):
+    # Taskの結果を 完了 / スキップ (新しい行が無く未実行) / 失敗 (タイムアウトを含む) に分けて表示し、失敗したタスクを返す
+    groups = [
+        ("succeeded", [task for task, state in states.items() if state == 'SUCCEEDED']),
+        ("skipped", [task for task, state in states.items() if state == 'SKIPPED']),
+        ("failed", [task for task, state in states.items() if state not in task_done_states]),
+    ]
+    for label, tasks in groups:
+        if tasks:
+            print("%s: %s" % (label, ", ".join("%s (%s)" % (task, states[task]) if label == "failed" else task for task in tasks)))
+    return groups[-1][1]
+
+
+creds_path = '../setting/creds.yaml'
+token_path = './metadata/jquants_token.json'
+
+# J-Quantsのリフレッシュトークンの有効期間は1週間。余裕を持って6日で取り直す
+refresh_token_days = 6
+
+# プロセス内で共有する接続 (初回利用時に作成)
+_connections = {}
+_connection_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=None)
+def load_creds():
+    # 認証情報は1回だけ読み込む (設定ファイルが無い場合は環境変数)
+    if os.path.exists(creds_path):
+        with open(creds_path) as file:
+            return yaml.safe_load(file)
+
+    return {
+        'snowflake' : {key: os.environ.get(key) for key in ['account', 'username', 'password', 'database', 'warehouse', 'schema', 'role']},
+        'jquants' : {key: os.environ.get(key) for key in ['my_mail_address', 'my_password']},
+    }
+
+
+def snowflake_session():
+    # ロール・DB・スキーマは接続パラメータで指定し、use_*の往復を省く
+    with _connection_lock:
+        if 'snowflake' not in _connections:
+            conf = load_creds()['snowflake']
+            connection_parameters = {
+                "account": conf['account'],
+                "user": conf['username'],
+                "password": conf['password'],
+                "database": conf['database'],
+                "schema": conf['schema'],
+                "warehouse": conf['warehouse'],
+                "role" : conf['role']
+            }
+            _connections['snowflake'] = Session.builder.configs(connection_parameters).create()
+        return _connections['snowflake']
+
+
+def load_refresh_token():
+    if os.path.exists(token_path):
+        with open(token_path) as file:
+            token = json.load(file)
+        if pd.Timestamp(token['expires']) > pd.Timestamp.now(tz='UTC'):
+            return token['refresh_token']
+    return None
+
+
+def save_refresh_token(refresh_token):
+    os.makedirs(os.path.dirname(token_path), exist_ok=True)
+    expires = pd.Timestamp.now(tz='UTC') + pd.Timedelta(refresh_token_days, unit='D')
+    tmp_path = token_path + '.tmp'
+    with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as file:
+        json.dump({'refresh_token' : refresh_token, 'expires' : expires.isoformat()}, file)
+    os.replace(tmp_path, token_path)
+
+
+def jquants_client():
+    # 有効期限内のリフレッシュトークンがあればメールアドレス・パスワードでの認証を省く
+    with _connection_lock:
+        if 'jquants' not in _connections:
+            refresh_token = load_refresh_token()
+            client = None
+            if refresh_token is not None:
+                client = jquantsapi.Client(refresh_token=refresh_token)
+                try:
+                    # 期限内でも失効・パスワード変更で拒否される場合があるため、IDトークンの取得で確認する
+                    client.get_id_token()
+                except requests.exceptions.HTTPError:
+                    os.remove(token_path)
+                    client = None
+            if client is None:
+                conf = load_creds()['jquants']
+                client = jquantsapi.Client(mail_address=conf['my_mail_address'], password=conf['my_password'])
+                save_refresh_token(client.get_refresh_token())
+            _connections['jquants'] = client
+        return _connections['jquants']
+
 
 class Snowflake:
-    def __init__(self):
-        if os.path.exists('../setting/creds.yaml'):
-            with open('../setting/creds.yaml') as file:
-                conf = yaml.safe_load(file)
-                sf_account = conf['snowflake']['account']
-                sf_user = conf['snowflake']['username']
-                sf_password = conf['snowflake']['password']
-                sf_database = conf['snowflake']['database']
-                sf_warehouse = conf['snowflake']['warehouse']
-                sf_schema = conf['snowflake']['schema']
-                sf_role = conf['snowflake']['role']
-        else:
-            sf_account = os.environ.get('account')
-            sf_user = os.environ.get('username')
-            sf_password = os.environ.get('password')
-            sf_database = os.environ.get('database')
-            sf_warehouse = os.environ.get('warehouse')
-            sf_schema = os.environ.get('schema')
-            sf_role = os.environ.get('role')
-
-        connection_parameters = {
-            "account": sf_account,
-            "user": sf_user,
-            "password": sf_password,
-            "database": sf_database,
-            "schema": sf_schema,
-            "warehouse": sf_warehouse,
-            "role" : sf_role
-        }
-
-        # セッションの作成＆ロール、DB、スキーマの指定
-        self.session = Session.builder.configs(connection_parameters).create()
-        self.session.use_role(sf_role)
-        self.session.use_database(sf_database)
-        self.session.use_schema(sf_schema)
+    def __init__(self, session=None):
+        # セッションは初回のクエリ実行時に作成し、プロセス内で共有
+        self._session = session
+        self.pending = []
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = snowflake_session()
+        return self._session
+
+    @session.setter
+    def session(self, session):
+        self._session = session
+
+    def execute(self, query, wait=True):
+        # wait=Falseの場合は非同期に実行し、wait_pendingでまとめて完了を待つ
+        if wait:
+            return self.session.sql(query).collect()
+        self.pending.append(self.session.sql(query).collect_nowait())
+
+    def wait_pending(self):
+        jobs, self.pending = self.pending, []
+        return [job.result() for job in jobs]
 
     def resume_task(self, task):
         query = '''alter task %s resume;''' % (task)
-        self.session.sql(query).collect()
+        self.execute(query)
 
 
     def suspend_task(self, task):
         query = '''alter task %s suspend;''' % (task)
-        self.session.sql(query).collect()
+        self.execute(query)
+
+
+    def run_statements(self, queries, wait=True):
+        # 複数の文をScriptingブロックにまとめて1回の往復で実行
+        if len(queries) == 1:
+            self.execute(queries[0], wait)
+        elif queries:
+            block = 'execute immediate $$ begin %s end; $$' % ' '.join(q.strip().rstrip(';') + ';' for q in queries)
+            self.execute(block, wait)
+
+
+    def resume_tasks(self, tasks, wait=True):
+        self.run_statements(['alter task %s resume' % task for task in tasks], wait)
+
+
+    def suspend_tasks(self, tasks, wait=True):
+        self.run_statements(['alter task %s suspend' % task for task in tasks], wait)
+
+
+    def current_timestamp(self):
+        return self.execute('select current_timestamp()')[0][0]
+
+
+    def task_runs(self, tasks, since):
+        # since以降にスケジュールされ、完了した実行の一覧
+        query = '''select lower(name), state, scheduled_time from table(information_schema.task_history(
+            scheduled_time_range_start => to_timestamp_ltz('%s'), result_limit => 10000))
+            where state in (%s)
+            and lower(name) in (%s);''' % (since.isoformat(), ', '.join("'%s'" % state for state in task_done_states + task_failed_states),
+                                          ', '.join("'%s'" % task.lower() for task in tasks))
+        return self.execute(query)
+
+
+    def wait_tasks(self, since, timeout=900, interval=5, max_interval=60):
+        # since: {タスク名: 起点時刻}。起点以降に開始した実行の完了をバックオフ付きでポーリングし、
+        # 完了 (SUCCEEDED / SKIPPED / 失敗) したタスクから順に停止する。タイムアウトしたタスクも停止し、状態をTIMEOUTとして返す
+        pending = {task.lower(): ts for task, ts in since.items()}
+        states = {}
+        deadline = time.monotonic() + timeout
+        while pending:
+            completed = {}
+            for name, state, scheduled in self.task_runs(list(pending), min(pending.values())):
+                if name in pending and scheduled >= pending[name]:
+                    completed[name] = state
+            if completed:
+                self.suspend_tasks(list(completed))
+                states.update(completed)
+                for name in completed:
+                    pending.pop(name)
+                continue
+
+            if time.monotonic() >= deadline:
+                self.suspend_tasks(list(pending))
+                states.update({name: 'TIMEOUT' for name in pending})
+                break
+            time.sleep(min(interval, max(0, deadline - time.monotonic())))
+            interval = min(interval * 2, max_interval)
+
+        return states
 
 
     def put_stage(self, path, stage):
         self.session.file.put(path, stage, overwrite=True)    
 
 
+    def stage_frame(self, df, stage, name, format='csv', files=1, encoding='utf8'):
+        # ローカルファイルを経由せず、圧縮済みのバッファをステージに直接転送
+        # files > 1 の場合は行を分割して複数ファイルにし、COPYを並列に実行させる
+        # csv: <name>.<i>.gz (gzip) / parquet: <name>.<i>.parquet (snappy)
+        def put(part):
+            i, frame = part
+            buffer = io.BytesIO()
+            if format == 'parquet':
+                frame.to_parquet(buffer, index=False, compression='snappy', coerce_timestamps='us', allow_truncated_timestamps=True)
+                path = '%s.%d.parquet' % (name, i)
+            else:
+                frame.to_csv(buffer, index=False, encoding=encoding, compression={'method' : 'gzip', 'mtime' : 0})
+                path = '%s.%d.gz' % (name, i)
+            size = buffer.tell()
+            buffer.seek(0)
+            self.session.file.put_stream(buffer, '%s/%s' % (stage, path), auto_compress=False, overwrite=True)
+            return size
+
+        bounds = np.linspace(0, len(df), max(1, min(files, len(df))) + 1).astype(int)
+        parts = [(i, df.iloc[lo:hi]) for i, (lo, hi) in enumerate(zip(bounds[:-1], bounds[1:]))]
+        with ThreadPoolExecutor(len(parts)) as pool:
+            return sum(pool.map(put, parts))
+
+
+    def copy_query(self, table, stage, format, pattern, force=False):
+        # force: ロード履歴に関係なく取り込む (同じ名前・内容のファイルを再度ステージした場合)
+        return '''copy into %s from %s
+            file_format = (format_name = %s)
+            pattern = '%s'%s;''' % (table, stage, format, pattern, ' force = true' if force else '')
+
+
     def copy_table(self, table, stage, format, pattern):
+        self.execute(self.copy_query(table, stage, format, pattern))
+
+
+    def apply_diff(self, table, key, keys, stage, format, pattern, copy=True):
+        # 変更・削除のあったキーの行を削除し、ステージ済みの変更行をCOPYする (1トランザクション)
+        # キーは作業用テーブルにロードして結合で削除する (キー数に比例して長くなる条件式を作らない)
+        # 差分ファイルは名前・内容が過去のロードと同じ場合がある (A→B→Aの変更など) ためforceで必ず取り込む
+        keys_table = '%s_diff_keys' % table
+        keys_stage = '@%%%s' % keys_table
+        self.execute('create or replace transient table %s as select %s from %s where false;' % (keys_table, ', '.join(key), table))
+        self.stage_frame(keys, keys_stage, 'keys')
+
+        queries = [
+            self.copy_query(keys_table, keys_stage, format, '.*keys.*', force=True),
+            'begin transaction',
+            'delete from %s using %s k where %s' % (table, keys_table, ' and '.join('%s.%s = k.%s' % (table, col, col) for col in key)),
+        ]
+        if copy:
+            queries.append(self.copy_query(table, stage, format, pattern, force=True))
+        queries += ['commit', 'drop table %s' % keys_table]
+        self.run_statements(queries)
+
+
+    def copy_table_parquet(self, table, stage, pattern):
+        # Parquetはカラム名で対応付けてロード
         query = '''copy into %s from %s 
-            file_format = (format_name = %s)
-            pattern = '%s';''' % (table, stage, format, pattern)
-        self.session.sql(query).collect()
+            file_format = (type = parquet)
+            match_by_column_name = case_insensitive
+            pattern = '%s';''' % (table, stage, pattern)
+        self.execute(query)
 
 
-    def remove_stage(self, stage):
+    def remove_stage(self, stage, wait=True):
         query = '''remove %s;''' % (stage)
-        self.session.sql(query).collect()
+        self.execute(query, wait)
 
 
     def convert_column_type(self, df):
         # テーブル作成用のカラム取得
-        data_schema = ''
-        for (c, d) in zip(df.columns, df.dtypes):
-            if str(d) == 'object':
-                datatype = 'STRING'
-            elif str(d) == 'float64':
-                datatype = 'NUMBER'
-            elif str(d) == 'datetime64[ns]':
-                datatype = 'DATE'
-            data_schema += c + ' ' + datatype + ', '
-
-        data_schema = data_schema[0:-2]
-
-        return data_schema
+        return snowflake_schema(df)
 
     def replace_table(self, table, schema):
         query = '''create or replace table %s (%s);''' % (table, schema)
-        self.session.sql(query).collect()
+        self.execute(query)
 
 
     def truncate_table(self, table):
         query = '''truncate table %s;''' % (table)
-        self.session.sql(query).collect()
+        self.execute(query)
 
 
 class JQuants:
-    def __init__(self):
-        if os.path.exists('../setting/creds.yaml'):
-            with open('../setting/creds.yaml') as file:
-                conf = yaml.safe_load(file)
-                my_mail_address = conf['jquants']['my_mail_address']
-                my_password = conf['jquants']['my_password']
-        else:
-            my_mail_address = os.environ.get('my_mail_address')
-            my_password = os.environ.get('my_password')
-
-        self.jqapi = jquantsapi.Client(mail_address=my_mail_address, password=my_password)
-
-    def get_financial(self, period=4):
-        # 3カ月前の株価データ取得
+    def __init__(self, max_concurrency=4, client=None, cache=True):
+        # クライアントは初回のAPI呼び出し時に作成し、プロセス内で共有
+        self._client = client
+        self.max_concurrency = max_concurrency
+        self.limiter = threading.BoundedSemaphore(max_concurrency)
+        self.cache = (ResponseCache() if cache is True else cache) or None
+
+    @property
+    def jqapi(self):
+        if self._client is None:
+            self._client = jquants_client()
+        return self._client
+
+    def request(self, func, *args, ttl=0, **kwargs):
+        # 全データセット共通の同時リクエスト数上限
+        # ttl: キャッシュ有効期間(秒)。Noneは無期限、0はキャッシュしない
+        use_cache = self.cache is not None and ttl != 0
+        if use_cache:
+            key = self.cache.key(func.__name__, *args, **kwargs)
+            df = self.cache.get(key)
+            if df is not None:
+                return df
+
+        with self.limiter:
+            df = call_with_backoff(func, *args, **kwargs)
+
+        if use_cache:
+            self.cache.put(key, df, ttl)
+        return df
+
+    def request_master(self, func):
+        return self.request(func, ttl=cache_ttl.get(func.__name__, 0))
+
+    def request_range(self, func, start_dt, end_dt):
+        # 日付単位に正規化して取得。当日を含まない確定済みの範囲はキャッシュ (cache_ttlに無いものは無期限)
+        today = pd.Timestamp.now(tz="Asia/Tokyo").tz_localize(None).normalize()
+        start_dt = pd.Timestamp(start_dt).tz_localize(None).normalize()
+        end_dt = pd.Timestamp(end_dt).tz_localize(None).normalize()
+        return self.request(func, start_dt=start_dt, end_dt=end_dt, ttl=cache_ttl.get(func.__name__) if end_dt < today else 0)
+
+    def fetch_range(self, func, start_dt, end_dt, chunk_days=None):
+        # 期間をchunk_days単位に分割して並列に取得
+        if not chunk_days:
+            return self.request_range(func, start_dt, end_dt)
+
+        starts = pd.date_range(start_dt, end_dt, freq="%dD" % chunk_days)
+        bounds = [(s, min(s + pd.Timedelta(chunk_days - 1, unit="D"), end_dt)) for s in starts]
+        with ThreadPoolExecutor(self.max_concurrency) as pool:
+            frames = list(pool.map(lambda b: self.request_range(func, b[0], b[1]), bounds))
+
+        frames = [frame for frame in frames if len(frame)]
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    def get_financial(self, period=4, chunk_days=None, since=None, until=None):
+        # 3カ月前の株価データ取得 (sinceを指定した場合はその日時以降の差分のみ、untilで終端を指定)
         now = pd.Timestamp.now(tz="Asia/Tokyo")
-        start_dt = now - pd.offsets.MonthBegin(period)
+        start_dt = now - pd.offsets.MonthBegin(period) if since is None else since
         # start_dt = now - pd.offsets.YearBegin(period)
-        end_dt = now
-        stock_fin_load: pd.DataFrame = self.jqapi.get_statements_range(start_dt=start_dt, end_dt=end_dt)
-
-        # 財務情報のいくつかがobject型になっているので数値型に変換
-        numeric_cols_fin = [
-            'AverageNumberOfShares', 'BookValuePerShare', 'EarningsPerShare','Equity', 'EquityToAssetRatio',
-            'ForecastDividendPerShare1stQuarter', 'ForecastDividendPerShare2ndQuarter', 'ForecastDividendPerShare3rdQuarter',
-            'ForecastDividendPerShareAnnual', 'ForecastDividendPerShareFiscalYearEnd', 'ForecastEarningsPerShare', 'ForecastNetSales', 'ForecastOperatingProfit',
-            'ForecastOrdinaryProfit', 'ForecastProfit', 'NetSales', 'NumberOfIssuedAndOutstandingSharesAtTheEndOfFiscalYearIncludingTreasuryStock',
-            'OperatingProfit', 'OrdinaryProfit', 'Profit', 'ResultDividendPerShare1stQuarter','ResultDividendPerShare2ndQuarter','ResultDividendPerShare3rdQuarter',
-            'ResultDividendPerShareAnnual','ResultDividendPerShareFiscalYearEnd','TotalAssets']
-        stock_fin_load[numeric_cols_fin] = stock_fin_load[numeric_cols_fin].apply(pd.to_numeric, errors='coerce', axis=1)
-
-        # 財務情報のobject型をdatetime64[ns]型に変換
-        stock_fin_load["DisclosedDate"] = pd.to_datetime(stock_fin_load["DisclosedDate"]) #開示
-        stock_fin_load["CurrentFiscalYearEndDate"] = pd.to_datetime(stock_fin_load["CurrentFiscalYearEndDate"])  # 当事業年度終了日
-        stock_fin_load["CurrentFiscalYearStartDate"] = pd.to_datetime(stock_fin_load["CurrentFiscalYearStartDate"])  # 当事業年度開始日
-        stock_fin_load["CurrentPeriodEndDate"] = pd.to_datetime(stock_fin_load["CurrentPeriodEndDate"]) # 当会計期間終了日
+        end_dt = now if until is None else until
+        stock_fin_load: pd.DataFrame = self.fetch_range(self.jqapi.get_statements_range, start_dt, end_dt, chunk_days)
+        if stock_fin_load.empty:
+            return stock_fin_load
+
+        # 数値・日付・銘柄コードを型定義に従って列単位で変換 (普通株の5桁コードは4桁に)
+        stock_fin_load = normalize(stock_fin_load, "statements")
 
         # 財務情報の値を調整します
         stock_fin_load["Result_FinancialStatementFiscalYear"] = stock_fin_load["CurrentFiscalYearEndDate"].dt.strftime("%Y")
@@ -143,65 +408,67 @@ class JQuants:
         stock_fin_load = stock_fin_load.loc[~stock_fin_load["TypeOfDocument"].isin(["ForecastRevision", "NumericalCorrection", "ForecastRevision_REIT"])]
         stock_fin_load = stock_fin_load.sort_values("DisclosedUnixTime").drop_duplicates(subset=["LocalCode", "DisclosedDate"], keep="last")
 
-        # 普通株 (5桁で末尾が0) の銘柄コードを4桁にします
-        stock_fin_load.loc[(stock_fin_load["LocalCode"].str.len() == 5) & (stock_fin_load["LocalCode"].str[-1] == "0"), "LocalCode"] = stock_fin_load.loc[(stock_fin_load["LocalCode"].str.len() == 5) & (stock_fin_load["LocalCode"].str[-1] == "0"), "LocalCode"].str[:-1]
-
         # コード・日付でソート & インデックス最適化
         stock_fin_load.drop_duplicates(subset=['LocalCode', 'DisclosedDate'], inplace=True)
         stock_fin_load.reset_index(inplace=True, drop=True)
 
         return stock_fin_load
 
-    def get_stock(self, period=7):
-        # 7日間の株価データ取得
+    def get_stock(self, period=7, chunk_days=None, since=None, until=None):
+        # 7日間の株価データ取得 (sinceを指定した場合はその日時以降の差分のみ、untilで終端を指定)
         now = pd.Timestamp.now(tz="Asia/Tokyo")
-        start_dt = now - pd.offsets.Day(period)
+        start_dt = now - pd.offsets.Day(period) if since is None else since
         end_dt = now
         if end_dt.hour < 19:
             end_dt -= pd.Timedelta(1, unit="D")
-        stocks = self.jqapi.get_price_range(
-            start_dt=start_dt, end_dt=end_dt
-        )
+        if until is not None:
+            end_dt = min(end_dt, until)
+        stocks = self.fetch_range(self.jqapi.get_price_range, start_dt, end_dt, chunk_days)
+        if stocks.empty:
+            return stocks
 
         # 結合と重複データ削除
         stocks.drop_duplicates(subset=['Code', 'Date'], inplace=True)
         stocks.reset_index(inplace=True, drop=True)
 
-        # 普通株 (5桁で末尾が0) の銘柄コードを4桁にします
-        stocks.loc[(stocks["Code"].str.len() == 5) & (stocks["Code"].str[-1] == "0"), "Code"] = stocks.loc[(stocks["Code"].str.len() == 5) & (stocks["Code"].str[-1] == "0"), "Code"].str[:-1]
-
-        # 株価情報のいくつかがobject型になっているので数値型に変換
-        stocks["AdjustmentOpen"] = stocks["AdjustmentOpen"].astype(np.float64)
-        stocks["AdjustmentHigh"] = stocks["AdjustmentHigh"].astype(np.float64)
-        stocks["AdjustmentLow"] = stocks["AdjustmentLow"].astype(np.float64)
-        stocks["AdjustmentClose"] = stocks["AdjustmentClose"].astype(np.float64)
-        for item in ['Open','High', 'Low', 'Close', 'Volume', 'Volume', 'TurnoverValue', 'AdjustmentFactor']:
-            stocks[item] = stocks[item].astype('float')
-        
+        # 数値・日付・銘柄コードを型定義に従って列単位で変換 (普通株の5桁コードは4桁に)
+        stocks = normalize(stocks, "prices")
+
         return stocks
 
+    def get_stock_history(self, codes, period=400):
+        # 銘柄ごとの調整後株価の履歴 (分割・併合で書き換わるためキャッシュしない)
+        end_dt = pd.Timestamp.now(tz="Asia/Tokyo")
+        start_dt = end_dt - pd.offsets.Day(period)
+        request = lambda code: self.request(self.jqapi.get_prices_daily_quotes, code=code,
+                                            from_yyyymmdd=start_dt.strftime("%Y%m%d"), to_yyyymmdd=end_dt.strftime("%Y%m%d"))
+        with ThreadPoolExecutor(self.max_concurrency) as pool:
+            frames = [frame for frame in pool.map(request, codes) if len(frame)]
+        if not frames:
+            return pd.DataFrame()
+        return normalize(pd.concat(frames, ignore_index=True), "prices")
+
     def get_stock_code(self):
         # 普通株 (5桁で末尾が0) の銘柄コードを4桁にします
-        stock_list = self.jqapi.get_listed_info()
-        stock_list.loc[(stock_list["Code"].str.len() == 5) & (stock_list["Code"].str[-1] == "0"), "Code"] = stock_list.loc[(stock_list["Code"].str.len() == 5) & (stock_list["Code"].str[-1] == "0"), "Code"].str[:-1]
-        return stock_list
+        stock_list = self.request_master(self.jqapi.get_listed_info)
+        return normalize(stock_list, "listed_info")
 
     def get_sector_code(self):
-        stock_sectors = self.jqapi.get_listed_sections()
+        stock_sectors = self.request_master(self.jqapi.get_listed_sections)
         return stock_sectors
 
     def get_sector_17_code(self):
-        stock_sectors = self.jqapi.get_17_sectors()
+        stock_sectors = self.request_master(self.jqapi.get_17_sectors)
         return stock_sectors
 
     def get_sector_33_code(self):
-        stock_sectors = self.jqapi.get_33_sectors()
+        stock_sectors = self.request_master(self.jqapi.get_33_sectors)
         return stock_sectors
 
     def get_market_code(self):
-        stock_market = self.jqapi.get_market_segments()
+        stock_market = self.request_master(self.jqapi.get_market_segments)
         return stock_market
     
     def get_topix(self):
-        topix = self.jqapi.get_indices_topix()
-        return topix
\ No newline at end of file
+        topix = self.request_master(self.jqapi.get_indices_topix)
+        return topix
@@ -0,0 +1,178 @@
+import hashlib
+import inspect
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import script.features
+from script.features import GroupedPanel, feature_params, warmup_rows
+
+
+feature_cache_dir = "./metadata/feature_cache"
+
+
+def hash_values(values):
+    # 列の値を行ごとのuint64ハッシュに変換 (文字列は重複を除いた値のみハッシュ)
+    values = pd.Series(values)
+    if pd.api.types.is_numeric_dtype(values):
+        return pd.util.hash_array(values.to_numpy(dtype=np.float64, na_value=np.nan))
+    ids, uniques = pd.factorize(values)
+    return np.where(ids >= 0, pd.util.hash_array(np.asarray(uniques, dtype=object))[ids], np.uint64(0))
+
+
+class FeatureCache(object):
+    # 特徴量 (feature_engineeringの出力列) を入力データ・パラメータ・特徴量のコードの内容から決まるキーで保存
+    # 入力は日付ごとのハッシュで比較し、末尾の日付のみ変わった場合はそれ以前の行を再利用して残りだけ計算する
+    # 容量を超えた場合は最終アクセスの古い順に削除 (ResponseCacheと同じ管理方法)
+    def __init__(self, directory=feature_cache_dir, max_bytes=5 * 1024 ** 3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(directory, "index.json")
+        self.lock = threading.Lock()
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as file:
+                self.index = json.load(file)
+
+    def config_key(self, params, columns, compute):
+        # 特徴量のパラメータ・入力列・特徴量のコード (features.pyとcomputeの定義元) が同じ場合のみ再利用する
+        source = b""
+        for path in sorted({script.features.__file__, inspect.getsourcefile(compute)}):
+            with open(path, "rb") as file:
+                source += file.read()
+        text = json.dumps([dict(feature_params, **(params or {})), list(columns)], sort_keys=True).encode("utf8")
+        return hashlib.sha1(text + source).hexdigest()
+
+    def date_hashes(self, df, panel, columns):
+        # 日付ごとの行ハッシュの和 (行順に依存しない指紋)
+        # uint64の和は上位・下位32bitに分けてbincountで集計し、2^64で折り返して合成
+        row_hash = pd.util.hash_array(np.asarray(panel.codes, dtype=object))[panel.code_ids]
+        for col in columns:
+            row_hash = row_hash * np.uint64(1000003) ^ panel.take(hash_values(df[col]))
+
+        date_ids, dates = pd.factorize(panel.date_keys, sort=True)
+        low = np.bincount(date_ids, weights=row_hash & np.uint64(0xFFFFFFFF), minlength=len(dates))
+        high = np.bincount(date_ids, weights=row_hash >> np.uint64(32), minlength=len(dates))
+        hashes = low.astype(np.uint64) + (high.astype(np.uint64) << np.uint64(32))
+        return np.asarray(dates), hashes
+
+    def path(self, key, kind="parquet"):
+        return os.path.join(self.directory, "%s.%s" % (key, kind))
+
+    def longest_prefix(self, config, dates, hashes):
+        # 同じ設定の保存済みデータのうち、先頭から一致する日付が最も長いもの
+        best, best_len = None, 0
+        for key, entry in self.index.items():
+            if entry["config"] != config or not os.path.exists(self.path(key, "dates.parquet")):
+                continue
+            saved = pd.read_parquet(self.path(key, "dates.parquet"))
+            n = min(len(saved), len(dates))
+            same = (saved["DATE"].values[:n] == dates[:n]) & (saved["HASH"].values[:n] == hashes[:n])
+            length = n if same.all() else int(np.argmin(same))
+            if length > best_len:
+                best, best_len = key, length
+        return best, best_len
+
+    def features(self, df, panel, params, compute, columns=("CLOSE", "VOLUME", "SECTOR33CODENAME")):
+        # compute(df, panel, params) -> 列名: ソート済み配列 の結果をキャッシュ経由で返す
+        columns = [col for col in columns if col in df]
+        config = self.config_key(params, columns, compute)
+        dates, hashes = self.date_hashes(df, panel, columns)
+        key = hashlib.sha1(config.encode("utf8") + dates.tobytes() + hashes.tobytes()).hexdigest()
+
+        cached = self.get(key)
+        if cached is not None and len(cached) == panel.size:
+            return {col: cached[col].values for col in cached.columns if col != "DATE"}
+
+        with self.lock:
+            prefix_key, prefix_len = self.longest_prefix(config, dates, hashes)
+        if prefix_key is None or prefix_len == len(dates):
+            features = compute(df, panel, params)
+        else:
+            features = self.extend(df, panel, params, compute, self.get(prefix_key), dates[prefix_len])
+
+        self.put(key, config, dates, hashes, dict(features, DATE=panel.date_keys))
+        return features
+
+    def extend(self, df, panel, params, compute, cached, cutoff):
+        # cutoffより前の行は保存済みの値を使い、以降の行のみ各銘柄のウォームアップ分を含めて計算
+        prefix = panel.date_keys < cutoff
+        if cached is None:
+            return compute(df, panel, params)
+        cached = cached[cached["DATE"].values < cutoff]
+        if len(cached) != prefix.sum():
+            return compute(df, panel, params)
+
+        tail_count = np.add.reduceat((~prefix).astype(np.int64), panel.starts) if panel.size else np.array([], dtype=np.int64)
+        first_tail = np.repeat(panel.ends - tail_count, panel.ends - panel.starts)
+        keep = (np.arange(panel.size) >= first_tail - warmup_rows(params)) & np.repeat(tail_count > 0, panel.ends - panel.starts)
+
+        sub = df.iloc[panel.order[keep]]
+        sub_panel = GroupedPanel(sub["CODE"], sub["DATE"])
+        tail = compute(sub, sub_panel, params)
+        tail_rows = sub_panel.date_keys >= cutoff
+
+        features = {}
+        for col, values in tail.items():
+            out = np.empty(panel.size, dtype=values.dtype)
+            out[prefix] = cached[col].values
+            out[~prefix] = values[tail_rows]
+            features[col] = out
+        return features
+
+    def get(self, key):
+        with self.lock:
+            entry = self.index.get(key)
+            if entry is None or not os.path.exists(self.path(key)):
+                return None
+            entry["accessed"] = time.time()
+            self.save_index()
+        return pd.read_parquet(self.path(key))
+
+    def put(self, key, config, dates, hashes, features):
+        os.makedirs(self.directory, exist_ok=True)
+        suffix = ".%d.tmp" % threading.get_ident()
+        pd.DataFrame(features).to_parquet(self.path(key) + suffix, index=False, compression="zstd")
+        pd.DataFrame({"DATE" : dates, "HASH" : hashes}).to_parquet(self.path(key, "dates.parquet") + suffix, index=False)
+        os.replace(self.path(key) + suffix, self.path(key))
+        os.replace(self.path(key, "dates.parquet") + suffix, self.path(key, "dates.parquet"))
+
+        with self.lock:
+            self.index[key] = {
+                "config" : config,
+                "size" : os.path.getsize(self.path(key)) + os.path.getsize(self.path(key, "dates.parquet")),
+                "accessed" : time.time(),
+            }
+            self.evict()
+            self.save_index()
+
+    def remove(self, key):
+        self.index.pop(key, None)
+        for path in [self.path(key), self.path(key, "dates.parquet")]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def evict(self):
+        total = sum(entry["size"] for entry in self.index.values())
+        for key in sorted(self.index, key=lambda key: self.index[key]["accessed"]):
+            if total <= self.max_bytes:
+                break
+            total -= self.index[key]["size"]
+            self.remove(key)
+
+    def save_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(self.index, file)
+        os.replace(tmp_path, self.index_path)
+
+    def clear(self):
+        with self.lock:
+            for key in list(self.index):
+                self.remove(key)
+            self.save_index()
@@ -0,0 +1,167 @@
+import numpy as np
+import pandas as pd
+from pandas.api.indexers import BaseIndexer
+
+
+# feature_engineeringのウィンドウ長・閾値 (パラメータスイープで上書き可能)
+feature_params = {
+    "ma_short" : 51,
+    "ma_mid" : 151,
+    "ma_long" : 201,
+    "window_52" : 53,
+    "low_band" : 1.3,
+    "high_band" : 0.75,
+    "rsi_threshold" : 1.7,
+}
+
+
+# 日付ごとに全銘柄を比較して求める特徴量 (銘柄単位では計算できない)
+rank_features = ["RS_RATING", "SECTOR_RS", "SECTOR_RANK"]
+
+
+def warmup_rows(params=None):
+    # 特徴量の計算に必要な銘柄ごとの過去の行数 (最長のウィンドウ・RSIの最長ラグ252日)
+    params = dict(feature_params, **(params or {}))
+    return max(params["ma_short"], params["ma_mid"], params["ma_long"], params["window_52"] + 1, 252 + 1)
+
+
+class GroupWindowIndexer(BaseIndexer):
+    # 銘柄ごとの連続区間をまたがないローリングウィンドウ
+    # (group_startには各行が属する銘柄区間の先頭位置を渡す)
+    def get_window_bounds(self, num_values=0, min_periods=None, center=None, closed=None, step=None):
+        end = np.arange(1, num_values + 1, dtype=np.int64)
+        start = np.maximum(end - self.window_size, self.group_start).astype(np.int64)
+        return start, end
+
+
+class GroupedPanel(object):
+    # (CODE, DATE)で一度だけソートし、銘柄の区間境界を保持するパネル
+    def __init__(self, codes, dates):
+        code_ids, self.codes = pd.factorize(np.asarray(codes), sort=True)
+        date_keys = pd.to_datetime(np.asarray(dates)).values.astype("datetime64[ns]").view(np.int64)
+        self.order = np.lexsort((date_keys, code_ids))
+        self.size = len(self.order)
+
+        sorted_ids = code_ids[self.order]
+        self.code_ids = sorted_ids
+        self.date_keys = date_keys[self.order]
+        self.starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]]) if self.size else np.array([], dtype=np.int64)
+        self.ends = np.r_[self.starts[1:], self.size].astype(np.int64)
+        self.row_start = np.repeat(self.starts, self.ends - self.starts)
+
+    def take(self, values):
+        # 元の行順 -> ソート順
+        return np.asarray(values)[self.order]
+
+    def restore(self, values):
+        # ソート順 -> 元の行順
+        out = np.empty_like(values)
+        out[self.order] = values
+        return out
+
+    def rolling(self, values, window, how):
+        indexer = GroupWindowIndexer(window_size=window, group_start=self.row_start)
+        rolled = pd.Series(values, dtype=np.float64).rolling(indexer, min_periods=1)
+        return getattr(rolled, how)().values
+
+    def shift(self, values, periods):
+        pos = np.arange(self.size) - periods
+        valid = pos >= self.row_start
+        shifted = np.full(self.size, np.nan)
+        shifted[valid] = values[pos[valid]]
+        return shifted
+
+    def pct_change(self, values, periods):
+        values = values.astype(np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return values / self.shift(values, periods) - 1
+
+
+def cross_sectional_ranks(panel, rs, sector_ids=None):
+    # 日付ごとに全銘柄のRSをパーセンタイル順位 (1〜99、算出不可は0) に変換し、セクター単位でも集計
+    # 日付 x 銘柄の密な配列に展開し、行方向に一括で順位付けする
+    date_ids, dates = pd.factorize(panel.date_keys, sort=True)
+    grid = np.full((len(dates), len(panel.codes)), np.nan)
+    grid[date_ids, panel.code_ids] = rs
+    pct = pd.DataFrame(grid).rank(axis=1, pct=True).values[date_ids, panel.code_ids]
+    rating = np.where(np.isnan(pct), 0, np.clip(np.ceil(pct * 99), 1, 99)).astype(np.int8)
+    ranks = {"RS_RATING" : rating}
+
+    if sector_ids is not None:
+        # セクター平均のRS_RATINGと、その日のセクター間順位 (1が最強、算出不可は0)
+        # sector_idsはセクター名をfactorizeした番号 (欠損は-1)
+        n_sectors = max(int(sector_ids.max()) + 1, 1)
+        valid = (rating > 0) & (sector_ids >= 0)
+        cell = date_ids[valid] * n_sectors + sector_ids[valid]
+        total = np.bincount(cell, weights=rating[valid], minlength=len(dates) * n_sectors)
+        count = np.bincount(cell, minlength=len(dates) * n_sectors)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = (total / count).reshape(len(dates), n_sectors)
+        order = pd.DataFrame(mean).rank(axis=1, ascending=False, method="min").values
+
+        has_sector = sector_ids >= 0
+        idx = (date_ids, np.maximum(sector_ids, 0))
+        ranks["SECTOR_RS"] = np.where(has_sector, mean[idx], np.nan).astype(np.float32)
+        ranks["SECTOR_RANK"] = np.where(has_sector, np.nan_to_num(order[idx]), 0).astype(np.int8)
+
+    return ranks
+
+
+def canslim_features(panel, close, volume, params=None, cache=None, sector_ids=None, cross_section=True):
+    # ソート済み配列からCANSLIMの特徴量を計算
+    # (cacheを渡すとウィンドウ長が同じローリング計算を複数のパラメータ間で共有する)
+    # sector_idsを渡すとセクター単位のRS集計も追加する
+    # cross_section=Falseの場合は銘柄単位の特徴量のみ (銘柄のシャードごとに計算する場合)
+    params = dict(feature_params, **(params or {}))
+    cache = {} if cache is None else cache
+
+    def cached(key, func):
+        if key not in cache:
+            cache[key] = func()
+        return cache[key]
+
+    def rolling(name, values, window, how):
+        return cached((name, window, how), lambda: panel.rolling(values(), window, how))
+
+    def lag(periods):
+        return cached(("LAG", periods), lambda: panel.pct_change(close, periods))
+
+    # CANSLIM基礎特徴料作成
+    ma_50 = rolling("CLOSE", lambda: close, params["ma_short"], "mean")
+    ma_150 = rolling("CLOSE", lambda: close, params["ma_mid"], "mean")
+    ma_200 = rolling("CLOSE", lambda: close, params["ma_long"], "mean")
+    low_52 = rolling("CLOSE", lambda: close, params["window_52"], "min")
+    high_52 = rolling("CLOSE", lambda: close, params["window_52"], "max")
+    rsi = cached("RSI", lambda: ((lag(63) * 0.4) + (lag(126) * 0.2) + (lag(189) * 0.2) + (lag(252) * 0.2)) * 100)
+
+    # UD_RATIO計算メソッド
+    lag_1_volume = cached(("LAG_VOLUME", 1), lambda: panel.pct_change(volume, 1))
+    vu = rolling("VOL_PLUS", lambda: np.where(lag_1_volume >= 0, volume, 0), params["window_52"], "sum")
+    vd = rolling("VOL_MINUS", lambda: np.where(lag_1_volume <= 0, volume, 0), params["window_52"], "sum")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ud_ratio = vu / vd
+    ud_ratio[~np.isfinite(ud_ratio)] = 0
+
+    # CANSLIM上昇トレンド判定メソッド
+    up_cond1 = (close > ma_150) & (close > ma_200)
+    up_cond2 = ma_150 > ma_200
+    up_cond4 = (ma_50 > ma_150) & (ma_50 > ma_200)
+    up_cond5 = close > ma_50
+    up_cond6 = close > low_52 * params["low_band"]
+    up_cond7 = close > high_52 * params["high_band"]
+    up_cond8 = rsi > params["rsi_threshold"]
+
+    # 全銘柄の中での相対的な強さ (日付ごとのクロスセクション順位)
+    ranks = cached(("RS_RANKS", sector_ids is not None), lambda: cross_sectional_ranks(panel, rsi, sector_ids)) if cross_section else {}
+
+    return dict(ranks, **{
+        "MA_50" : ma_50,
+        "MA_150" : ma_150,
+        "MA_200" : ma_200,
+        "LOW_52" : low_52,
+        "HIGH_52" : high_52,
+        "RSI" : rsi,
+        "UD_RATIO" : ud_ratio,
+        "UP_MATCH_COND_NUM" : up_cond1.astype(np.int8) + up_cond2 + up_cond4 + up_cond5 + up_cond6 + up_cond7 + up_cond8,
+        "UP_MATCH_COND_TREND" : (up_cond1 & up_cond4 & up_cond5 & up_cond6).astype(np.int8),
+    })
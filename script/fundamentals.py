@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+
+
+# 東証の大引け。これより前に開示された決算のみ当日の終値時点で利用可能とみなす
+market_close = pd.Timedelta(hours=15)
+
+# 決算期の種類 -> 会計年度内の四半期の番号
+quarter_numbers = {"1Q" : 1, "2Q" : 2, "3Q" : 3, "FY" : 4}
+
+fundamental_columns = ["EPS_QOQ", "EPS_YOY", "SALES_QOQ", "SALES_YOY", "EPS_ANNUAL_GROWTH", "SALES_ANNUAL_GROWTH"]
+
+
+def growth(current, previous):
+    # 前期がマイナス・ゼロの場合の成長率は定義しない
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(previous > 0, current / previous - 1, np.nan)
+
+
+def statement_growth(statements):
+    # 決算短信 (累計値) から四半期単独の値を求め、前四半期比・前年同期比・通期の前年比を計算
+    df = statements[["LocalCode", "DisclosedDate", "DisclosedTime", "TypeOfCurrentPeriod",
+                     "CurrentPeriodEndDate", "CurrentFiscalYearStartDate", "EarningsPerShare", "NetSales"]].copy()
+    df["LocalCode"] = df["LocalCode"].astype(str)
+    df = df.sort_values(["LocalCode", "CurrentPeriodEndDate", "DisclosedDate"], kind="mergesort")
+    df = df.drop_duplicates(subset=["LocalCode", "CurrentPeriodEndDate"], keep="last").reset_index(drop=True)
+
+    # 四半期単独の値: 第1四半期は累計値そのもの、それ以外は同一会計年度の直前の四半期の累計値との差分
+    # (直前の四半期が取得期間外・欠落している場合は求められないので欠損とする)
+    quarter = df["TypeOfCurrentPeriod"].map(quarter_numbers).values
+    fiscal_year = df.groupby(["LocalCode", "CurrentFiscalYearStartDate"], sort=False)
+    previous = (fiscal_year["TypeOfCurrentPeriod"].shift(1).map(quarter_numbers).values == quarter - 1)
+    first = quarter == 1
+    for col, out in [("EarningsPerShare", "EPS_Q"), ("NetSales", "SALES_Q")]:
+        df[out] = np.where(first, df[col], np.where(previous, df[col] - fiscal_year[col].shift(1), np.nan))
+
+    # 前四半期比 (直前の決算期と連続している場合のみ)
+    code = df.groupby("LocalCode", sort=False)
+    prev_end = code["CurrentPeriodEndDate"].shift(1)
+    consecutive = ((df["CurrentPeriodEndDate"] - prev_end).dt.days.between(80, 100)).values
+    df["EPS_QOQ"] = np.where(consecutive, growth(df["EPS_Q"], code["EPS_Q"].shift(1)), np.nan)
+    df["SALES_QOQ"] = np.where(consecutive, growth(df["SALES_Q"], code["SALES_Q"].shift(1)), np.nan)
+
+    # 前年同期比・通期の前年比 (1年前の同じ決算期と突き合わせる)
+    period = df["CurrentPeriodEndDate"].dt.to_period("M")
+    prev_year = df[["EPS_Q", "SALES_Q", "EarningsPerShare", "NetSales"]].set_index(
+        pd.MultiIndex.from_arrays([df["LocalCode"], period + 12]))
+    prev_year = prev_year[~prev_year.index.duplicated(keep="last")]
+    prev = prev_year.reindex(pd.MultiIndex.from_arrays([df["LocalCode"], period]))
+    df["EPS_YOY"] = growth(df["EPS_Q"].values, prev["EPS_Q"].values)
+    df["SALES_YOY"] = growth(df["SALES_Q"].values, prev["SALES_Q"].values)
+
+    annual = (df["TypeOfCurrentPeriod"] == "FY").values
+    df["EPS_ANNUAL_GROWTH"] = np.where(annual, growth(df["EarningsPerShare"].values, prev["EarningsPerShare"].values), np.nan)
+    df["SALES_ANNUAL_GROWTH"] = np.where(annual, growth(df["NetSales"].values, prev["NetSales"].values), np.nan)
+
+    # 開示順に並べ、通期の成長率は次の本決算まで引き継ぐ (それ以前の開示のみ参照)
+    available = pd.to_datetime(df["DisclosedDate"]) + pd.to_timedelta(df["DisclosedTime"].fillna("23:59:59").astype(str))
+    df["AVAILABLE_TIME"] = available
+    df = df.sort_values(["LocalCode", "AVAILABLE_TIME"], kind="mergesort")
+    df[["EPS_ANNUAL_GROWTH", "SALES_ANNUAL_GROWTH"]] = df.groupby("LocalCode", sort=False)[["EPS_ANNUAL_GROWTH", "SALES_ANNUAL_GROWTH"]].ffill()
+
+    return df[["LocalCode", "AVAILABLE_TIME"] + fundamental_columns].reset_index(drop=True)
+
+
+def attach_fundamentals(prices, statements, columns=fundamental_columns):
+    # 各取引日の大引け時点で開示済みの最新の決算を (CODE, DATE) に結合する (先読み無し)
+    growth_table = statement_growth(statements)
+    growth_table = growth_table.rename(columns={"LocalCode" : "CODE"}).sort_values("AVAILABLE_TIME", kind="mergesort")
+
+    left = pd.DataFrame({
+        "CODE" : prices["CODE"].astype(str).values,
+        "BAR_TIME" : pd.to_datetime(prices["DATE"]).values + market_close.to_timedelta64(),
+        "ROW" : np.arange(len(prices)),
+    })
+    left["BAR_TIME"] = left["BAR_TIME"].astype(growth_table["AVAILABLE_TIME"].dtype)
+    left = left.sort_values("BAR_TIME", kind="mergesort")
+
+    merged = pd.merge_asof(left, growth_table[["CODE", "AVAILABLE_TIME"] + list(columns)],
+                           left_on="BAR_TIME", right_on="AVAILABLE_TIME", by="CODE",
+                           direction="backward", allow_exact_matches=False)
+
+    out = np.full((len(prices), len(columns)), np.nan, dtype=np.float32)
+    out[merged["ROW"].values] = merged[list(columns)].values.astype(np.float32)
+    return prices.assign(**{col: out[:, i] for i, col in enumerate(columns)})
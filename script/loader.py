@@ -0,0 +1,118 @@
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as fs
+import duckdb
+
+from script.warehouse import warehouse_path
+
+
+# 開発用パネルのParquet/Arrow IPCデータセット (年ごとのhiveパーティション)
+dataset_path = "/Users/smurakawa/src/portfolio/data/data/stock_df_dev"
+partitioning = ds.partitioning(pa.schema([("YEAR", pa.int16())]), flavor="hive")
+
+
+def write_dataset(df, path=dataset_path, format="parquet"):
+    # 年パーティション内は(CODE, DATE)順に並べ、銘柄での絞り込みでも行グループを読み飛ばせるようにする
+    df = df.assign(DATE=pd.to_datetime(df["DATE"]))
+    df = df.sort_values(["CODE", "DATE"], kind="mergesort")
+    df["YEAR"] = df["DATE"].dt.year.astype("int16")
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    ds.write_dataset(table, path, format=format, partitioning=partitioning,
+                     existing_data_behavior="delete_matching", max_rows_per_group=256 * 1024)
+
+
+def convert_pickle(pickle_path, path=dataset_path, format="parquet"):
+    write_dataset(pd.read_pickle(pickle_path), path, format)
+
+
+def read_dataset(path=dataset_path, columns=None, start=None, end=None, codes=None, format="parquet", memory_map=True):
+    # カラム射影と期間・銘柄の絞り込みをリーダー側で実行
+    dataset = ds.dataset(path, format=format, partitioning=partitioning,
+                         filesystem=fs.LocalFileSystem(use_mmap=memory_map))
+
+    expr = None
+    if start is not None:
+        start = pd.Timestamp(start)
+        expr = (ds.field("YEAR") >= start.year) & (ds.field("DATE") >= start.to_pydatetime())
+    if end is not None:
+        end = pd.Timestamp(end)
+        cond = (ds.field("YEAR") <= end.year) & (ds.field("DATE") <= end.to_pydatetime())
+        expr = cond if expr is None else expr & cond
+    if codes is not None:
+        cond = ds.field("CODE").isin(list(codes))
+        expr = cond if expr is None else expr & cond
+
+    table = dataset.to_table(columns=columns, filter=expr)
+    return table.to_pandas()
+
+
+def exists_dataset(path=dataset_path):
+    return os.path.isdir(path)
+
+
+# ローカルの分析用データベースから開発用パネルと同じ列名で読み込む際の対応
+warehouse_columns = {
+    "DATE" : "p.Date",
+    "CODE" : "p.Code",
+    "COMPANYNAME" : "c.CompanyName",
+    "SECTOR33CODENAME" : "c.Sector33CodeName",
+    "SECTOR17CODENAME" : "c.Sector17CodeName",
+    "OPEN" : "p.AdjustmentOpen",
+    "HIGH" : "p.AdjustmentHigh",
+    "LOW" : "p.AdjustmentLow",
+    "CLOSE" : "p.AdjustmentClose",
+    "VOLUME" : "p.AdjustmentVolume",
+}
+
+
+def read_warehouse(path=warehouse_path, columns=None, start=None, end=None, codes=None):
+    # 取り込み済みの株価テーブルと銘柄一覧を結合し、列の射影と期間・銘柄の絞り込みをDuckDB側で実行
+    columns = columns or list(warehouse_columns)
+    query = "select %s from stock p" % ", ".join("%s as %s" % (warehouse_columns[col], col) for col in columns)
+    if any(warehouse_columns[col].startswith("c.") for col in columns):
+        query += " left join stock_code c on p.Code = c.Code"
+
+    conditions, params = [], []
+    if start is not None:
+        conditions.append("p.Date >= ?")
+        params.append(pd.Timestamp(start).to_pydatetime())
+    if end is not None:
+        conditions.append("p.Date <= ?")
+        params.append(pd.Timestamp(end).to_pydatetime())
+    if codes is not None:
+        conditions.append("p.Code in (%s)" % ", ".join("?" * len(codes)))
+        params.extend(str(code) for code in codes)
+    if conditions:
+        query += " where " + " and ".join(conditions)
+
+    with duckdb.connect(path, read_only=True) as connection:
+        return connection.execute(query + " order by p.Code, p.Date", params).df()
+
+
+def exists_warehouse(path=warehouse_path):
+    if not os.path.exists(path):
+        return False
+    with duckdb.connect(path, read_only=True) as connection:
+        return len(connection.execute("select 1 from information_schema.tables where table_name = 'stock'").fetchall()) > 0
+
+
+def read_statements(path=warehouse_path, start=None, end=None):
+    # 取り込み済みの決算短信 (成長率の計算に必要な列のみ)
+    query = """select LocalCode, DisclosedDate, DisclosedTime, TypeOfCurrentPeriod, CurrentPeriodEndDate,
+        CurrentFiscalYearStartDate, EarningsPerShare, NetSales from financial"""
+    conditions, params = [], []
+    if start is not None:
+        conditions.append("DisclosedDate >= ?")
+        params.append(pd.Timestamp(start).to_pydatetime())
+    if end is not None:
+        conditions.append("DisclosedDate <= ?")
+        params.append(pd.Timestamp(end).to_pydatetime())
+    if conditions:
+        query += " where " + " and ".join(conditions)
+
+    with duckdb.connect(path, read_only=True) as connection:
+        return connection.execute(query, params).df()
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+
+
+# 価格系の列は精度を落とさないようfloat64、それ以外の実数特徴量はfloat32で保持
+price_columns = ["OPEN", "HIGH", "LOW", "CLOSE"]
+
+
+class Panel(object):
+    # 日付 x 銘柄の密な配列で価格・特徴量を保持するパネル
+    # 銘柄・セクターは整数IDとルックアップテーブル、欠損セルはvalidマスクで管理する
+    def __init__(self, dates, codes, values, valid, sectors=None, sector_ids=None):
+        self.dates = dates
+        self.codes = codes
+        self.values = values
+        self.valid = valid
+        self.sectors = sectors
+        self.sector_ids = sector_ids
+
+    @classmethod
+    def from_frame(cls, df, columns, dtypes=None, sector_col="SECTOR33CODENAME"):
+        dtypes = dtypes or {}
+        date_ids, dates = pd.factorize(pd.to_datetime(df["DATE"]).values.astype("datetime64[D]"), sort=True)
+        code_ids, codes = pd.factorize(df["CODE"], sort=True)
+        date_ids = date_ids.astype(np.int32)
+        code_ids = code_ids.astype(np.int32)
+        shape = (len(dates), len(codes))
+
+        valid = np.zeros(shape, dtype=bool)
+        valid[date_ids, code_ids] = True
+
+        values = {}
+        for col in columns:
+            src = df[col].values
+            if col in dtypes:
+                dtype = np.dtype(dtypes[col])
+            elif np.issubdtype(src.dtype, np.floating):
+                dtype = np.dtype(np.float64 if col in price_columns else np.float32)
+            else:
+                dtype = src.dtype
+            fill = np.nan if np.issubdtype(dtype, np.floating) else 0
+            values[col] = np.full(shape, fill, dtype=dtype)
+            values[col][date_ids, code_ids] = src
+
+        # セクターは銘柄ごとに最新の値を採用
+        sectors, sector_ids = None, None
+        if sector_col is not None and sector_col in df:
+            ids, sectors = pd.factorize(df[sector_col], sort=True)
+            sector_ids = np.full(len(codes), -1, dtype=np.int16)
+            order = np.argsort(date_ids, kind="stable")
+            sector_ids[code_ids[order]] = ids[order]
+            sectors = np.asarray(sectors, dtype=object)
+
+        return cls(np.asarray(dates), np.asarray(codes, dtype=object), values, valid, sectors, sector_ids)
+
+    def to_frame(self, columns=None):
+        # 有効なセルのみを(CODE, DATE)順の縦持ちフレームに戻す
+        columns = list(self.values) if columns is None else columns
+        code_ids, date_ids = np.nonzero(self.valid.T)
+
+        df = pd.DataFrame({
+            "DATE" : pd.to_datetime(self.dates[date_ids]),
+            "CODE" : pd.Categorical.from_codes(code_ids, categories=self.codes),
+        })
+        if self.sectors is not None:
+            df["SECTOR33CODENAME"] = pd.Categorical.from_codes(self.sector_ids[code_ids], categories=self.sectors)
+        for col in columns:
+            df[col] = self.values[col][date_ids, code_ids]
+        return df
+
+    def date_index(self, date):
+        return np.int32(np.searchsorted(self.dates, np.datetime64(pd.Timestamp(date), "D")))
+
+    def code_index(self, code):
+        return np.int32(np.flatnonzero(self.codes == code)[0])
+
+    def nbytes(self):
+        total = self.dates.nbytes + self.valid.nbytes + sum(values.nbytes for values in self.values.values())
+        if self.sector_ids is not None:
+            total += self.sector_ids.nbytes
+        return total
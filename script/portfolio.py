@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+
+from script.backtest import BacktestBase, strategies, format_dates
+from script.rules import compile_rules
+from script.panel import Panel
+from script.result import ResultBuffer, result_path
+
+
+portfolio_columns = {"date" : "datetime64[D]", "cash" : "float64", "equity" : "float64", "positions" : "int32", "return" : "float64"}
+
+
+def ffill_rows(values):
+    # 欠損を直前の有効値で埋める (日付方向)
+    valid = ~np.isnan(values)
+    idx = np.where(valid, np.arange(len(values))[:, None], 0)
+    np.maximum.accumulate(idx, axis=0, out=idx)
+    return np.take_along_axis(values, idx, axis=0)
+
+
+class BacktestPortfolio(BacktestBase):
+    # 全銘柄で1つの口座を共有し、日付順に同時保有を考慮してシミュレーションする
+    def run_portfolio(self, data, name, max_positions=10, score=None):
+        print('----------------------- Start Run Portfolio %s ----------------------------' % name)
+
+        columns = ["CLOSE"] + [col for col in compile_rules(strategies, [name]).columns if col != "CLOSE"]
+        if score is not None and score not in columns:
+            columns.append(score)
+        panel = Panel.from_frame(data, columns)
+        dates, f = panel.dates, panel.values
+        entries, exits = strategies[name](f)
+        entries = np.asarray(entries, dtype=bool)
+        exits = np.asarray(exits, dtype=bool)
+
+        close = f["CLOSE"]
+        tradable = panel.valid & ~np.isnan(close)
+        mark = ffill_rows(close)
+        priority = -f[score] if score is not None else np.zeros_like(close)
+
+        n_dates, n_codes = close.shape
+        units = np.zeros(n_codes)
+        buy_price = np.zeros(n_codes)
+        held = np.zeros(n_codes, dtype=bool)
+        date_strs = format_dates(dates)
+        equity = np.empty(n_dates)
+        cash = np.empty(n_dates)
+        positions = np.empty(n_dates, dtype=np.int32)
+
+        for t in range(n_dates):
+            price = close[t]
+
+            # 保有銘柄のエグジット
+            sell = held & exits[t] & tradable[t]
+            if sell.any():
+                self.settle(units[sell], buy_price[sell], price[sell])
+                held[sell] = False
+                units[sell] = 0
+
+            # 空き枠の範囲でエントリー (scoreの高い順)
+            free = max_positions - held.sum()
+            buy = ~held & entries[t] & tradable[t]
+            if free > 0 and buy.any():
+                candidates = np.flatnonzero(buy)
+                candidates = candidates[np.argsort(priority[t, candidates], kind="stable")][:free]
+                net_wealth = self.amount + np.nansum(units * mark[t])
+                budget = min(net_wealth / max_positions, self.amount / len(candidates))
+                new_units = np.floor((budget - self.ftc) / (price[candidates] * (1 + self.ptc)))
+                ok = new_units > 0
+                candidates, new_units = candidates[ok], new_units[ok]
+
+                self.amount -= ((new_units * price[candidates]) * (1 + self.ptc) + self.ftc).sum()
+                self.trades += len(candidates)
+                units[candidates] = new_units
+                buy_price[candidates] = price[candidates]
+                held[candidates] = True
+
+            cash[t] = self.amount
+            equity[t] = self.amount + np.nansum(units * mark[t])
+            positions[t] = held.sum()
+
+        self.units = units
+        self.daily_ret = pd.DataFrame({
+            "date" : date_strs,
+            "cash" : cash,
+            "equity" : equity,
+            "positions" : positions,
+            "return" : pd.Series(equity).pct_change().fillna(0).values,
+        })
+
+        # 全銘柄の保有分を最終日の価格で手仕舞い
+        last = mark[-1] if n_dates else np.zeros(n_codes)
+        self.amount += np.nansum(units * last)
+        self.units = 0
+        self.trades += 1
+        self.print_metrics()
+        print('----------------------- End Run Portfolio %s ----------------------------' % name)
+
+        with ResultBuffer(result_path("portfolio_%s" % name, self.result_format), columns=portfolio_columns,
+                          format=self.result_format) as result:
+            result.extend(self.daily_ret)
+
+    def settle(self, units, buy_price, sell_price):
+        # 複数銘柄の売却をまとめて約定
+        self.amount += ((units * sell_price) * (1 - self.ptc) - self.ftc).sum()
+        self.trades += len(units)
+
+        ret = (sell_price - buy_price) * units
+        self.win_trades += int((ret > 0).sum())
+        self.win_amount += ret[ret > 0].sum()
+        self.lose_trades += int((ret < 0).sum())
+        self.lose_amount += ret[ret < 0].sum()
+        self.total_ret += ret.sum()
@@ -0,0 +1,118 @@
+import gzip
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+result_dir = "./backtest_result"
+
+# 日次累積リターンの列定義 (categoryは整数ID + 辞書で保持)
+daily_ret_columns = {"code" : "category", "date" : "datetime64[D]", "return" : "float64"}
+
+
+def result_path(name, format="parquet", compression=None):
+    if format == "parquet":
+        return os.path.join(result_dir, "%s.parquet" % name)
+    return os.path.join(result_dir, "%s.csv%s" % (name, ".gz" if compression == "gzip" else ""))
+
+
+class ResultBuffer(object):
+    # 事前確保した型付きの列バッファ。容量に達するたびにファイルへ書き出し、メモリ使用量を一定に保つ
+    def __init__(self, path, columns=None, format="parquet", capacity=1_000_000, compression=None):
+        self.path = path
+        self.columns = dict(columns or daily_ret_columns)
+        self.format = format
+        self.capacity = capacity
+        self.compression = compression or ("zstd" if format == "parquet" else None)
+        self.size = 0
+        self.rows = 0
+        self.writer = None
+
+        self.categories = {col: {} for col, dtype in self.columns.items() if dtype == "category"}
+        self.arrays = {
+            col: np.empty(capacity, dtype=np.int32 if dtype == "category" else np.dtype(dtype))
+            for col, dtype in self.columns.items()
+        }
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def encode(self, col, values):
+        ids, uniques = pd.factorize(np.asarray(values, dtype=object))
+        table = self.categories[col]
+        mapping = np.array([table.setdefault(value, len(table)) for value in uniques], dtype=np.int32)
+        return mapping[ids]
+
+    def append(self, row):
+        self.extend({col: [value] for col, value in row.items()})
+
+    def extend(self, columns):
+        values = {
+            col: self.encode(col, columns[col]) if col in self.categories
+            else np.asarray(columns[col]).astype(self.arrays[col].dtype, copy=False)
+            for col in self.columns
+        }
+        n = len(values[next(iter(self.columns))])
+
+        offset = 0
+        while offset < n:
+            take = min(self.capacity - self.size, n - offset)
+            for col, array in self.arrays.items():
+                array[self.size:self.size + take] = values[col][offset:offset + take]
+            self.size += take
+            offset += take
+            if self.size == self.capacity:
+                self.flush()
+
+    def table(self):
+        arrays = {}
+        for col, array in self.arrays.items():
+            values = array[:self.size]
+            if col in self.categories:
+                dictionary = pa.array([str(value) for value in self.categories[col]], pa.string())
+                arrays[col] = pa.DictionaryArray.from_arrays(pa.array(values, pa.int32()), dictionary)
+            else:
+                arrays[col] = pa.array(values)
+        return pa.table(arrays)
+
+    def flush(self):
+        if self.size == 0 and (self.rows > 0 or self.writer is not None):
+            return
+
+        table = self.table()
+        if self.format == "parquet":
+            if self.writer is None:
+                self.writer = pq.ParquetWriter(self.path, table.schema, compression=self.compression)
+            self.writer.write_table(table)
+        else:
+            opener = gzip.open if self.compression == "gzip" else open
+            with opener(self.path, "at" if self.rows else "wt", newline="") as file:
+                table.to_pandas().to_csv(file, header=self.rows == 0, index=False)
+
+        self.rows += self.size
+        self.size = 0
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def to_frame(self):
+        # 書き出し済みのファイルを読み込む (close後に使用)
+        if self.format == "parquet":
+            return pq.read_table(self.path).to_pandas()
+        return pd.read_csv(self.path)
+
+    def __len__(self):
+        return self.rows + self.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
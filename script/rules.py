@@ -0,0 +1,197 @@
+import operator
+
+import numpy as np
+
+
+# 式の演算子 (名前 -> (関数, 引数の順序を入れ替えても結果が同じか))
+operators = {
+    "eq" : (operator.eq, True),
+    "ne" : (operator.ne, True),
+    "lt" : (operator.lt, False),
+    "le" : (operator.le, False),
+    "gt" : (operator.gt, False),
+    "ge" : (operator.ge, False),
+    "and" : (operator.and_, True),
+    "or" : (operator.or_, True),
+    "add" : (operator.add, True),
+    "sub" : (operator.sub, False),
+    "mul" : (operator.mul, True),
+    "div" : (operator.truediv, False),
+    "invert" : (operator.invert, False),
+}
+
+
+def const_key(value):
+    # 定数の同一性 (スイープで渡される配列は内容で比較)
+    if isinstance(value, np.ndarray):
+        return ("array", value.dtype.str, value.shape, value.tobytes())
+    return ("value", type(value).__name__, value)
+
+
+class Expr(object):
+    # 特徴量の列に対する式。演算子で組み立てて、Programでまとめて配列演算に変換する
+    # keyは式の構造を表し、同じkeyの式 (共通部分式) は1度だけ評価される
+    # numpyの配列と比較した場合もExprの演算子を使う
+    __array_ufunc__ = None
+
+    def __init__(self, op, args=(), value=None):
+        self.op = op
+        self.args = tuple(args)
+        self.value = value
+        if op == "col":
+            self.key = ("col", value)
+        elif op == "const":
+            self.key = ("const", const_key(value))
+        else:
+            keys = [arg.key for arg in self.args]
+            if operators[op][1]:
+                keys = sorted(keys, key=repr)
+            self.key = (op,) + tuple(keys)
+
+    def binary(self, op, other, reverse=False):
+        other = other if isinstance(other, Expr) else lit(other)
+        return Expr(op, (other, self) if reverse else (self, other))
+
+    def __eq__(self, other):
+        return self.binary("eq", other)
+
+    def __ne__(self, other):
+        return self.binary("ne", other)
+
+    def __lt__(self, other):
+        return self.binary("lt", other)
+
+    def __le__(self, other):
+        return self.binary("le", other)
+
+    def __gt__(self, other):
+        return self.binary("gt", other)
+
+    def __ge__(self, other):
+        return self.binary("ge", other)
+
+    def __and__(self, other):
+        return self.binary("and", other)
+
+    def __or__(self, other):
+        return self.binary("or", other)
+
+    def __add__(self, other):
+        return self.binary("add", other)
+
+    def __radd__(self, other):
+        return self.binary("add", other, reverse=True)
+
+    def __sub__(self, other):
+        return self.binary("sub", other)
+
+    def __rsub__(self, other):
+        return self.binary("sub", other, reverse=True)
+
+    def __mul__(self, other):
+        return self.binary("mul", other)
+
+    def __rmul__(self, other):
+        return self.binary("mul", other, reverse=True)
+
+    def __truediv__(self, other):
+        return self.binary("div", other)
+
+    def __invert__(self):
+        return Expr("invert", (self,))
+
+    def between(self, low, high):
+        return (self >= low) & (self <= high)
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __bool__(self):
+        raise TypeError("Expr cannot be used as a Python bool; combine conditions with & and |")
+
+    def __repr__(self):
+        if self.op == "col":
+            return self.value
+        if self.op == "const":
+            return repr(self.value)
+        return "%s(%s)" % (self.op, ", ".join(repr(arg) for arg in self.args))
+
+
+def col(name):
+    return Expr("col", value=name)
+
+
+def lit(value):
+    return Expr("const", value=value)
+
+
+class Program(object):
+    # 複数の戦略のエントリー・エグジット条件を1つの演算列にまとめたもの
+    # 共通部分式は1度だけ計算し、以降参照されない中間結果はその場で解放する
+    def __init__(self, rules):
+        self.steps = []
+        self.outputs = {}
+        slots = {}
+
+        def visit(expr):
+            if expr.key in slots:
+                return slots[expr.key]
+            args = [visit(arg) for arg in expr.args]
+            slots[expr.key] = len(self.steps)
+            self.steps.append((expr.op, expr.value, args))
+            return slots[expr.key]
+
+        for name, (entries, exits) in rules.items():
+            self.outputs[name] = (visit(entries), visit(exits))
+
+        # 各中間結果を最後に参照するステップ (出力として使う結果は解放しない)
+        kept = {slot for pair in self.outputs.values() for slot in pair}
+        last_use = {}
+        for i, (_, _, args) in enumerate(self.steps):
+            for slot in args:
+                last_use[slot] = i
+        self.release = [[] for _ in self.steps]
+        for slot, i in last_use.items():
+            if slot not in kept:
+                self.release[i].append(slot)
+
+    @property
+    def columns(self):
+        return sorted({value for op, value, _ in self.steps if op == "col"})
+
+    def run(self, f):
+        # f: 列名 -> 配列 (DataFrameも可)。戻り値は 戦略名 -> (エントリー, エグジット) のbool配列
+        values = {}
+        for i, (op, value, args) in enumerate(self.steps):
+            if op == "col":
+                values[i] = np.asarray(f[value])
+            elif op == "const":
+                values[i] = value
+            else:
+                values[i] = operators[op][0](*[values[slot] for slot in args])
+            for slot in self.release[i]:
+                del values[slot]
+
+        return {
+            name: (np.asarray(values[entries], dtype=bool), np.asarray(values[exits], dtype=bool))
+            for name, (entries, exits) in self.outputs.items()
+        }
+
+
+class Strategy(object):
+    # パラメータから (エントリー条件, エグジット条件) の式を組み立てる関数を戦略として扱う
+    # 呼び出すと従来のシグナル関数と同じく (entries, exits) を返す
+    def __init__(self, build):
+        self.build = build
+
+    def rule(self, **params):
+        return self.build(**params)
+
+    def __call__(self, f, **params):
+        return Program({"" : self.rule(**params)}).run(f)[""]
+
+
+def compile_rules(strategies, names=None):
+    # 複数の戦略をまとめて1つのProgramに変換 (各戦略はデフォルトのパラメータ)
+    names = list(strategies) if names is None else names
+    return Program({name: strategies[name].rule() for name in names})
@@ -0,0 +1,149 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from script.backtest import BacktestCanslimTrade, strategies, signal_to_position, order_by_code
+from script.rules import compile_rules
+from script.result import ResultBuffer, result_path, result_dir
+
+
+# 共有メモリに載せる列 (戦略の条件で参照する列は実行時に追加)
+feature_columns = ["CLOSE"]
+
+
+class SharedFrame(object):
+    # 特徴量の列を共有メモリに1度だけ配置し、ワーカーからはゼロコピーで参照する
+    def __init__(self, spec, segments):
+        self.spec = spec
+        self.segments = segments
+        self.arrays = {
+            col: np.ndarray(shape, dtype=np.dtype(dtype), buffer=segments[col].buf)
+            for col, (_, dtype, shape) in spec.items()
+        }
+
+    @classmethod
+    def create(cls, arrays):
+        spec, segments = {}, {}
+        for col, values in arrays.items():
+            values = np.ascontiguousarray(values)
+            segment = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+            np.ndarray(values.shape, dtype=values.dtype, buffer=segment.buf)[...] = values
+            spec[col] = (segment.name, values.dtype.str, values.shape)
+            segments[col] = segment
+        return cls(spec, segments)
+
+    @classmethod
+    def attach(cls, spec):
+        segments = {}
+        for col, (name, _, _) in spec.items():
+            segments[col] = shared_memory.SharedMemory(name=name)
+        return cls(spec, segments)
+
+    def close(self):
+        self.arrays = {}
+        for segment in self.segments.values():
+            segment.close()
+
+    def unlink(self):
+        self.close()
+        for segment in self.segments.values():
+            segment.unlink()
+
+
+_shared = None
+
+
+def _init_worker(spec):
+    global _shared
+    _shared = SharedFrame.attach(spec)
+
+
+def _position_task(names, lo, hi):
+    # 銘柄シャード単位のポジション計算 (直前シャードからの持ち越しは親プロセスで補正)
+    # シャード内の全戦略の条件を1度に評価し、共通部分式は1回だけ計算する
+    f = {col: values[lo:hi] for col, values in _shared.arrays.items()}
+    signals = compile_rules(strategies, names).run(f)
+
+    results = {}
+    for name, (entries, exits) in signals.items():
+        decisive = np.flatnonzero(entries ^ exits)
+        first = decisive[0] if len(decisive) else hi - lo
+        results[name] = (signal_to_position(entries, exits), first)
+    return results
+
+
+def _account_task(name, position, codes, start, end, amount, ftc, ptc, result_format):
+    arrays = _shared.arrays
+    data = pd.DataFrame({
+        "CODE" : codes[arrays["CODE_ID"]],
+        "DATE" : arrays["DATE"],
+        "CLOSE" : arrays["CLOSE"],
+    })
+
+    bct = BacktestCanslimTrade(start, end, amount, ftc=ftc, ptc=ptc, verbose=False, result_format=result_format)
+    print('----------------------- Run Strategy %s ----------------------------' % name)
+    with ResultBuffer(result_path(name, result_format), format=result_format) as result:
+        bct.run_position(data, position, result)
+
+    return dict(strategy=name, **bct.metrics())
+
+
+def shard_bounds(code_ids, shards):
+    # 行数がほぼ均等になるよう、銘柄の境界で分割
+    n = len(code_ids)
+    starts = np.flatnonzero(np.r_[True, code_ids[1:] != code_ids[:-1]])
+    cuts = np.unique(starts[np.searchsorted(starts, np.linspace(0, n, shards + 1)[1:-1])])
+    bounds = np.r_[0, cuts[cuts > 0], n]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def stitch_positions(results):
+    # 直前シャードの最終ポジションを持ち越した場合は、最初の確定バーまでを反転
+    positions = []
+    carry = 0
+    for position, first in results:
+        if carry:
+            position = position.copy()
+            position[:first] ^= 1
+        positions.append(position)
+        if len(position):
+            carry = position[-1]
+    return np.concatenate(positions)
+
+
+def run_parallel(data, names, start, end, amount, ftc=0.0, ptc=0.0, processes=None, shards=None, result_format="parquet"):
+    processes = processes or os.cpu_count()
+    shards = shards or processes
+
+    data, _ = order_by_code(data)
+    code_ids, codes = pd.factorize(data["CODE"])
+    columns = list(dict.fromkeys(feature_columns + compile_rules(strategies, names).columns))
+    shared = SharedFrame.create(dict(
+        {col: data[col].values for col in columns},
+        CODE_ID=code_ids.astype(np.int32),
+        DATE=data["DATE"].values,
+    ))
+
+    try:
+        with ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(shared.spec,)) as pool:
+            # 銘柄シャードごとに全戦略のシグナル評価を並列化
+            bounds = shard_bounds(code_ids, shards)
+            futures = [pool.submit(_position_task, names, lo, hi) for lo, hi in bounds]
+            shard_results = [f.result() for f in futures]
+
+            # 戦略ごとの約定・集計も並列に実行
+            accounts = [
+                pool.submit(_account_task, name, stitch_positions([result[name] for result in shard_results]),
+                            np.asarray(codes), start, end, amount, ftc, ptc, result_format)
+                for name in names
+            ]
+            summary = pd.DataFrame([f.result() for f in accounts])
+    finally:
+        shared.unlink()
+
+    summary.to_csv(os.path.join(result_dir, "summary.csv"), index=False)
+    return summary
+
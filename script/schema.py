@@ -0,0 +1,83 @@
+import pandas as pd
+
+
+# J-Quantsの財務情報で文字列として返ってくる数値カラム
+statement_numeric_columns = [
+    'AverageNumberOfShares', 'BookValuePerShare', 'EarningsPerShare','Equity', 'EquityToAssetRatio',
+    'ForecastDividendPerShare1stQuarter', 'ForecastDividendPerShare2ndQuarter', 'ForecastDividendPerShare3rdQuarter',
+    'ForecastDividendPerShareAnnual', 'ForecastDividendPerShareFiscalYearEnd', 'ForecastEarningsPerShare', 'ForecastNetSales', 'ForecastOperatingProfit',
+    'ForecastOrdinaryProfit', 'ForecastProfit', 'NetSales', 'NumberOfIssuedAndOutstandingSharesAtTheEndOfFiscalYearIncludingTreasuryStock',
+    'OperatingProfit', 'OrdinaryProfit', 'Profit', 'ResultDividendPerShare1stQuarter','ResultDividendPerShare2ndQuarter','ResultDividendPerShare3rdQuarter',
+    'ResultDividendPerShareAnnual','ResultDividendPerShareFiscalYearEnd','TotalAssets']
+
+price_numeric_columns = [
+    'Open', 'High', 'Low', 'Close', 'Volume', 'TurnoverValue', 'AdjustmentFactor',
+    'AdjustmentOpen', 'AdjustmentHigh', 'AdjustmentLow', 'AdjustmentClose', 'AdjustmentVolume']
+
+# データセットごとの列の型定義
+# code: 銘柄コード (普通株の5桁コードを4桁に変換) / date: 日付 / float64, int64: 数値 / string: 文字列
+schemas = {
+    "statements" : {
+        "code" : "LocalCode",
+        "columns" : dict(
+            {"DisclosedDate" : "date", "CurrentFiscalYearEndDate" : "date", "CurrentFiscalYearStartDate" : "date",
+             "CurrentPeriodEndDate" : "date", "LocalCode" : "code"},
+            **{col: "float64" for col in statement_numeric_columns}),
+    },
+    "prices" : {
+        "code" : "Code",
+        "columns" : dict({"Date" : "date", "Code" : "code"}, **{col: "float64" for col in price_numeric_columns}),
+    },
+    "listed_info" : {
+        "code" : "Code",
+        "columns" : {"Code" : "code"},
+    },
+}
+
+# pandasの型からSnowflakeの型への対応
+snowflake_types = {
+    "b" : "BOOLEAN",
+    "i" : "NUMBER",
+    "u" : "NUMBER",
+    "f" : "FLOAT",
+    "M" : "DATE",
+}
+
+
+def normalize_code(codes):
+    # 普通株 (5桁で末尾が0) の銘柄コードを4桁にします
+    codes = codes.astype(str)
+    common = (codes.str.len() == 5) & codes.str.endswith("0")
+    return codes.where(~common, codes.str[:4])
+
+
+def normalize(df, dataset):
+    # 型定義に従って列単位でまとめて変換 (行ごとのapplyは使わない)
+    columns = schemas[dataset]["columns"]
+    converted = {}
+    for col, kind in columns.items():
+        if col not in df:
+            continue
+        if kind == "code":
+            converted[col] = normalize_code(df[col])
+        elif kind == "date":
+            converted[col] = pd.to_datetime(df[col])
+        elif kind == "string":
+            converted[col] = df[col].astype(str)
+        else:
+            values = df[col]
+            if not pd.api.types.is_numeric_dtype(values):
+                values = pd.to_numeric(values, errors="coerce")
+            converted[col] = values.astype(kind)
+    return df.assign(**converted)
+
+
+def snowflake_type(dtype):
+    if isinstance(dtype, pd.DatetimeTZDtype):
+        return "TIMESTAMP_TZ"
+    return snowflake_types.get(dtype.kind, "STRING")
+
+
+def snowflake_schema(df):
+    # テーブル作成用のカラム定義
+    return ", ".join("%s %s" % (col, snowflake_type(dtype)) for col, dtype in df.dtypes.items())
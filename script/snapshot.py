@@ -0,0 +1,59 @@
+import hashlib
+import os
+import pickle
+
+import pandas as pd
+
+
+snapshot_dir = "./metadata/master"
+
+
+class TableSnapshot(object):
+    # 前回取り込んだマスタの内容をローカルに保持し、今回取得分との差分を求める
+    # ignoreの列 (取得日など毎回変わる列) は比較の対象外
+    def __init__(self, table, key, ignore=(), directory=snapshot_dir):
+        self.table = table
+        self.key = list(key)
+        self.ignore = list(ignore)
+        self.path = os.path.join(directory, "%s.pkl" % table)
+        self.frame = None
+
+    def row_hash(self, df):
+        columns = [col for col in df.columns if col not in self.ignore]
+        return pd.Series(pd.util.hash_pandas_object(df[columns], index=False).values, index=pd.MultiIndex.from_frame(df[self.key]))
+
+    def fingerprint(self, df):
+        columns = [col for col in df.columns if col not in self.ignore]
+        text = ",".join(columns).encode("utf8") + pd.util.hash_pandas_object(df[columns], index=False).values.tobytes()
+        return hashlib.sha1(text).hexdigest()
+
+    def diff(self, df, max_ratio=0.5):
+        # 戻り値: (状態, 追加・更新行, 削除キー)
+        # 状態は unchanged (変更なし) / diff (行単位で反映) / full (テーブル再作成)
+        if self.frame is None or list(df.columns) != list(self.frame.columns) or df.dtypes.tolist() != self.frame.dtypes.tolist():
+            return "full", df, None
+        if self.fingerprint(df) == self.fingerprint(self.frame):
+            return "unchanged", df.iloc[:0], self.frame[self.key].iloc[:0]
+
+        new, old = self.row_hash(df), self.row_hash(self.frame)
+        changed = ~new.index.isin(old.index) | (new.values != old.reindex(new.index, fill_value=0).values)
+        deleted = ~old.index.isin(new.index)
+        if changed.sum() + deleted.sum() > max_ratio * len(df):
+            return "full", df, None
+        return "diff", df[changed], self.frame[self.key][deleted]
+
+    def save(self, df):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as file:
+            pickle.dump(df, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+        self.frame = df
+
+    @classmethod
+    def load(cls, table, key, ignore=(), directory=snapshot_dir):
+        snapshot = cls(table, key, ignore, directory)
+        if os.path.exists(snapshot.path):
+            with open(snapshot.path, "rb") as file:
+                snapshot.frame = pickle.load(file)
+        return snapshot
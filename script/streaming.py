@@ -0,0 +1,258 @@
+import os
+import pickle
+import math
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+
+state_path = "./metadata/indicator_state.pkl"
+latest_path = "./metadata/indicator_latest.pkl"
+
+
+class RollingSum(object):
+    # pandasのrolling().sum()/mean()と同じ加算・減算順序の補正付き累積和
+    __slots__ = ("window", "values", "nobs", "neg_ct", "sum_x", "comp_add", "comp_remove", "same_ct", "prev_value")
+
+    def __init__(self, window):
+        self.window = window
+        self.values = deque()
+        self.nobs = 0
+        self.neg_ct = 0
+        self.sum_x = 0.0
+        self.comp_add = 0.0
+        self.comp_remove = 0.0
+        self.same_ct = 0
+        self.prev_value = None
+
+    def push(self, val):
+        if self.prev_value is None:
+            self.prev_value = val
+
+        # ウィンドウから外れる値の削除
+        if len(self.values) == self.window:
+            old = self.values.popleft()
+            if old == old:
+                self.nobs -= 1
+                if math.copysign(1.0, old) < 0:
+                    self.neg_ct -= 1
+                y = - old - self.comp_remove
+                t = self.sum_x + y
+                self.comp_remove = t - self.sum_x - y
+                self.sum_x = t
+
+        # 新しい値の追加
+        self.values.append(val)
+        if val == val:
+            self.nobs += 1
+            if math.copysign(1.0, val) < 0:
+                self.neg_ct += 1
+            y = val - self.comp_add
+            t = self.sum_x + y
+            self.comp_add = t - self.sum_x - y
+            self.sum_x = t
+
+            if val == self.prev_value:
+                self.same_ct += 1
+            else:
+                self.same_ct = 1
+            self.prev_value = val
+
+    def sum(self):
+        if self.nobs == 0:
+            return np.nan
+        if self.same_ct >= self.nobs:
+            return self.prev_value * self.nobs
+        return self.sum_x
+
+    def mean(self):
+        if self.nobs == 0:
+            return np.nan
+        result = self.sum_x / self.nobs
+        if self.same_ct >= self.nobs:
+            result = self.prev_value
+        elif self.neg_ct == 0 and result < 0:
+            result = 0.0
+        elif self.neg_ct == self.nobs and result > 0:
+            result = 0.0
+        return result
+
+
+class RollingExtreme(object):
+    # 単調デックによるローリング最小値/最大値 (NaNは除外)
+    __slots__ = ("window", "sign", "deque", "bar")
+
+    def __init__(self, window, sign):
+        self.window = window
+        self.sign = sign
+        self.deque = deque()
+        self.bar = 0
+
+    def push(self, val):
+        if self.deque and self.deque[0][0] <= self.bar - self.window:
+            self.deque.popleft()
+        if val == val:
+            key = val * self.sign
+            while self.deque and self.deque[-1][1] * self.sign <= key:
+                self.deque.pop()
+            self.deque.append((self.bar, val))
+        self.bar += 1
+
+    def value(self):
+        return self.deque[0][1] if self.deque else np.nan
+
+
+class CodeIndicatorState(object):
+    # 1銘柄分のCANSLIM特徴量の状態 (feature_engineeringと同じウィンドウ長)
+    __slots__ = ("last_date", "closes", "prev_volume", "ma_50", "ma_150", "ma_200", "low_52", "high_52", "vu", "vd")
+
+    def __init__(self):
+        self.last_date = None
+        self.closes = deque(maxlen=253)
+        self.prev_volume = np.nan
+        self.ma_50 = RollingSum(51)
+        self.ma_150 = RollingSum(151)
+        self.ma_200 = RollingSum(201)
+        self.low_52 = RollingExtreme(53, -1)
+        self.high_52 = RollingExtreme(53, 1)
+        self.vu = RollingSum(53)
+        self.vd = RollingSum(53)
+
+    def lag(self, periods):
+        if len(self.closes) <= periods:
+            return np.nan
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.float64(self.closes[-1]) / self.closes[-1 - periods] - 1
+
+    def push(self, date, close, volume):
+        self.last_date = date
+        self.closes.append(close)
+        for window in (self.ma_50, self.ma_150, self.ma_200, self.low_52, self.high_52):
+            window.push(close)
+
+        # UD_RATIO
+        with np.errstate(divide="ignore", invalid="ignore"):
+            lag_1_volume = np.float64(volume) / self.prev_volume - 1
+        self.prev_volume = volume
+        self.vu.push(volume if lag_1_volume >= 0 else 0.0)
+        self.vd.push(volume if lag_1_volume <= 0 else 0.0)
+
+        return self.features(close)
+
+    def features(self, close):
+        ma_50, ma_150, ma_200 = self.ma_50.mean(), self.ma_150.mean(), self.ma_200.mean()
+        low_52, high_52 = self.low_52.value(), self.high_52.value()
+        rsi = ((self.lag(63) * 0.4) + (self.lag(126) * 0.2) + (self.lag(189) * 0.2) + (self.lag(252) * 0.2)) * 100
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ud_ratio = np.float64(self.vu.sum()) / self.vd.sum()
+        if not np.isfinite(ud_ratio):
+            ud_ratio = 0.0
+
+        # CANSLIM上昇トレンド判定
+        up_cond1 = (close > ma_150) and (close > ma_200)
+        up_cond2 = ma_150 > ma_200
+        up_cond4 = (ma_50 > ma_150) and (ma_50 > ma_200)
+        up_cond5 = close > ma_50
+        up_cond6 = close > low_52 * 1.3
+        up_cond7 = close > high_52 * 0.75
+        up_cond8 = rsi > 1.7
+
+        return [self.last_date, close, ma_50, ma_150, ma_200, low_52, high_52, rsi, ud_ratio,
+                sum(map(int, (up_cond1, up_cond2, up_cond4, up_cond5, up_cond6, up_cond7, up_cond8))),
+                int(up_cond1 and up_cond4 and up_cond5 and up_cond6)]
+
+
+class IndicatorEngine(object):
+    # 銘柄ごとのローリング状態を保持し、新しいバーだけで特徴量を更新する
+    columns = ["CODE", "DATE", "CLOSE", "MA_50", "MA_150", "MA_200", "LOW_52", "HIGH_52", "RSI", "UD_RATIO",
+               "UP_MATCH_COND_NUM", "UP_MATCH_COND_TREND"]
+
+    def __init__(self):
+        self.states = {}
+
+    def update(self, df, code_col="Code", date_col="Date", close_col="AdjustmentClose", volume_col="AdjustmentVolume",
+               factor_col="AdjustmentFactor", history=None):
+        # history: 銘柄コードのリスト -> 同じ列を持つ調整後の株価履歴 (分割・併合のあった銘柄の状態の再初期化に使用)
+        df = df[[col for col in [code_col, date_col, close_col, volume_col, factor_col] if col in df]]
+        df = df.assign(**{date_col: pd.to_datetime(df[date_col])}).sort_values([code_col, date_col], kind="mergesort")
+        if history is not None and factor_col in df:
+            self.reseed(df, history, code_col, date_col, close_col, volume_col, factor_col)
+
+        rows = []
+        for code, date, close, volume in zip(df[code_col].values, df[date_col].values,
+                                             df[close_col].values.astype(np.float64),
+                                             df[volume_col].values.astype(np.float64)):
+            state = self.states.get(code)
+            if state is None:
+                state = self.states[code] = CodeIndicatorState()
+
+            # 取り込み済みの日付は再計算しない
+            if state.last_date is not None and date <= state.last_date:
+                continue
+            rows.append([code] + state.push(date, close, volume))
+
+        return self.to_frame(rows)
+
+    def reseed(self, df, history, code_col, date_col, close_col, volume_col, factor_col):
+        # 分割・併合 (調整係数が1以外) のあった銘柄は過去の調整後価格が書き換わるため、
+        # 保持している状態を破棄し、今回の最初のバーより前の履歴から作り直す
+        factor = df[factor_col].values.astype(np.float64)
+        codes = sorted(set(df[code_col].values[(factor == factor) & (factor != 1)]))
+        if not codes:
+            return
+
+        past = history(codes)
+        for code in codes:
+            self.states[code] = CodeIndicatorState()
+        if len(past) == 0:
+            return
+
+        past = past.assign(**{date_col: pd.to_datetime(past[date_col])}).sort_values([code_col, date_col], kind="mergesort")
+        first_dates = past[code_col].map(df.groupby(code_col)[date_col].min())
+        past = past[past[date_col] < first_dates]
+        for code, date, close, volume in zip(past[code_col].values, past[date_col].values,
+                                             past[close_col].values.astype(np.float64),
+                                             past[volume_col].values.astype(np.float64)):
+            self.states[code].push(date, close, volume)
+
+    def snapshot(self):
+        # 各銘柄の最新バーの特徴量
+        rows = [[code] + state.features(state.closes[-1]) for code, state in self.states.items() if state.closes]
+        return self.to_frame(rows)
+
+    def to_frame(self, rows):
+        df = pd.DataFrame(rows, columns=self.columns)
+        return df.astype({"UP_MATCH_COND_NUM" : "int8", "UP_MATCH_COND_TREND" : "int8"})
+
+    def save(self, path=state_path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as file:
+            pickle.dump(self.states, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def from_history(cls, jqapi, period=400):
+        # 日次の取り込みと同じ調整後の株価で、特徴量のウォームアップに必要な期間から状態を初期化
+        engine = cls()
+        engine.update(jqapi.get_stock(period=period, chunk_days=30))
+        return engine
+
+    @classmethod
+    def load(cls, path=state_path):
+        engine = cls()
+        if os.path.exists(path):
+            with open(path, "rb") as file:
+                engine.states = pickle.load(file)
+        return engine
+
+
+if __name__ == "__main__":
+    # 日次の取り込み (import_stocks_info.py) と同じ調整後の株価で状態を初期化
+    from script.connect import JQuants
+
+    engine = IndicatorEngine.from_history(JQuants())
+    engine.save()
+    engine.snapshot().to_pickle(latest_path)
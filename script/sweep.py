@@ -0,0 +1,90 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from script.backtest import strategies, signal_to_position
+from script.features import GroupedPanel, canslim_features, feature_params
+
+
+def expand_grid(grid):
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*[grid[key] for key in keys])]
+
+
+def position_metrics(position, close, amount, ptc=0.0):
+    # バー x パラメータのポジション行列から、全額再投資(端株あり)での成績を列ごとに集計
+    k = position.shape[1]
+    diff = np.diff(position.T, axis=1, prepend=0)
+    buy_k, buy_t = np.nonzero(diff == 1)
+    sell_k, sell_t = np.nonzero(diff == -1)
+    buys = np.bincount(buy_k, minlength=k)
+    sells = np.bincount(sell_k, minlength=k)
+
+    # 各列のj番目の買いとj番目の売りが1トレード、売りのない最後の買いは最終バーで評価
+    rank = np.arange(len(buy_k)) - (np.cumsum(buys) - buys)[buy_k]
+    closed = rank < sells[buy_k]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        trade_ret = np.log(close[sell_t] / close[buy_t[closed]])
+        open_ret = np.log(close[-1] / close[buy_t[~closed]])
+    trade_ret[~np.isfinite(trade_ret)] = 0
+    open_ret[~np.isfinite(open_ret)] = 0
+
+    total_ret = np.bincount(sell_k, trade_ret, minlength=k) + np.bincount(buy_k[~closed], open_ret, minlength=k)
+    total_ret += sells * np.log1p(-ptc) - buys * np.log1p(ptc)
+    final_balance = amount * np.exp(total_ret)
+
+    win = trade_ret > 0
+    lose = trade_ret < 0
+    win_trades = np.bincount(sell_k[win], minlength=k)
+    lose_trades = np.bincount(sell_k[lose], minlength=k)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        avg_win = np.bincount(sell_k[win], np.expm1(trade_ret[win]), minlength=k) / win_trades
+        avg_lose = np.bincount(sell_k[lose], np.expm1(trade_ret[lose]), minlength=k) / lose_trades
+        closed_trades = win_trades + lose_trades
+
+        return pd.DataFrame({
+            "final_balance" : final_balance,
+            "net_performance" : (final_balance - amount) / amount,
+            "trades" : buys + sells + 1,
+            "win_trades" : win_trades,
+            "lose_trades" : lose_trades,
+            "win_rate" : win_trades / closed_trades,
+            "avg_return" : (final_balance - amount) / closed_trades,
+            "payoff_ratio" : np.abs(avg_win) / np.abs(avg_lose),
+        })
+
+
+def sweep(df, strategy, grid, amount=1000, ptc=0.0, max_cells=10_000_000, sort_by="net_performance"):
+    # gridのうちfeature_paramsのキーは特徴量側、それ以外は戦略関数の引数として扱う
+    # 特徴量パラメータごとに1度だけ特徴量を作り、戦略パラメータはまとめて行列で評価する
+    panel = GroupedPanel(df["CODE"], df["DATE"])
+    close = panel.take(df["CLOSE"]).astype(np.float64)
+    volume = panel.take(df["VOLUME"]).astype(np.float64)
+    sector_ids = panel.take(pd.factorize(df["SECTOR33CODENAME"])[0]) if "SECTOR33CODENAME" in df else None
+
+    feature_grid = {key: values for key, values in grid.items() if key in feature_params}
+    strategy_grid = {key: values for key, values in grid.items() if key not in feature_params}
+    strategy_points = expand_grid(strategy_grid)
+    chunk_size = max(1, int(max_cells // max(panel.size, 1)))
+
+    cache = {}
+    results = []
+    for fparams in expand_grid(feature_grid):
+        features = canslim_features(panel, close, volume, fparams, cache, sector_ids)
+        f = {col: values[:, None] for col, values in features.items()}
+
+        for i in range(0, len(strategy_points), chunk_size):
+            points = strategy_points[i:i + chunk_size]
+            sparams = {key: np.array([point[key] for point in points])[None, :] for key in strategy_grid}
+
+            entries, exits = strategies[strategy](f, **sparams)
+            shape = (panel.size, len(points))
+            position = signal_to_position(np.broadcast_to(entries, shape), np.broadcast_to(exits, shape))
+
+            metrics = position_metrics(position, close, amount, ptc)
+            params = pd.DataFrame([dict(fparams, **point) for point in points])
+            results.append(pd.concat([params, metrics], axis=1))
+
+    result = pd.concat(results, ignore_index=True)
+    return result.sort_values(sort_by, ascending=False, kind="mergesort").reset_index(drop=True)
@@ -0,0 +1,146 @@
+import numpy as np
+import pandas as pd
+
+from script.schema import statement_numeric_columns
+
+
+sector_33_names = ["水産・農林業", "建設業", "食料品", "化学", "医薬品", "電気機器", "輸送用機器", "情報・通信業", "銀行業", "サービス業"]
+sector_17_names = ["食品", "建設・資材", "素材・化学", "医薬品", "電機・精密", "自動車・輸送機", "情報通信・サービスその他", "銀行"]
+
+# 合成データの最終営業日 (実行日に依存せず同じseedで同じデータになるように固定)
+default_end = pd.Timestamp("2024-12-30")
+
+
+def make_codes(n_codes):
+    # 普通株の5桁コード (末尾0)
+    return np.array(["%04d0" % (1300 + i) for i in range(n_codes)])
+
+
+def make_dates(n_years, end=default_end):
+    return pd.bdate_range(end=end, periods=int(n_years * 245))
+
+
+def make_prices(n_codes, n_years, seed=0, end=default_end):
+    # get_price_range と同じスキーマの日足 (OHLCV + 調整後価格)
+    rng = np.random.default_rng(seed)
+    codes = make_codes(n_codes)
+    dates = make_dates(n_years, end)
+    n_dates = len(dates)
+
+    drift = rng.normal(0.0002, 0.0003, n_codes)
+    vol = rng.uniform(0.01, 0.03, n_codes)
+    log_ret = rng.standard_normal((n_dates, n_codes)) * vol + drift
+    close = np.round(rng.uniform(200, 20000, n_codes) * np.exp(np.cumsum(log_ret, axis=0)), 1)
+    spread = np.abs(rng.standard_normal((n_dates, n_codes))) * vol * close
+    high = np.round(close + spread, 1)
+    low = np.round(np.maximum(close - spread, 1), 1)
+    open_ = np.round(np.clip(close * (1 + rng.standard_normal((n_dates, n_codes)) * vol / 2), low, high), 1)
+    volume = np.round(rng.lognormal(11, 1, (n_dates, n_codes)), -2)
+
+    df = pd.DataFrame({
+        "Date" : np.repeat(dates.values, n_codes),
+        "Code" : np.tile(codes, n_dates),
+        "Open" : open_.ravel(),
+        "High" : high.ravel(),
+        "Low" : low.ravel(),
+        "Close" : close.ravel(),
+        "Volume" : volume.ravel(),
+        "TurnoverValue" : (close * volume).ravel(),
+        "AdjustmentFactor" : 1.0,
+    })
+    for col in ["Open", "High", "Low", "Close", "Volume"]:
+        df["Adjustment" + col] = df[col]
+    return df
+
+
+def make_statements(n_codes, n_years, seed=0, end=default_end):
+    # get_statements_range と同じスキーマの決算短信 (数値は文字列、欠損は空文字)
+    rng = np.random.default_rng(seed + 1)
+    codes = make_codes(n_codes)
+    n_quarters = int(n_years * 4)
+    period_end = pd.date_range(end=pd.Timestamp(end) - pd.offsets.QuarterEnd(1), periods=n_quarters, freq="QE")
+
+    code = np.repeat(codes, n_quarters)
+    end = np.tile(period_end.values, n_codes)
+    disclosed = pd.to_datetime(end) + pd.to_timedelta(rng.integers(25, 45, len(code)), unit="D")
+    quarter = np.tile(np.arange(n_quarters) % 4, n_codes)
+    fiscal_end = pd.to_datetime(end) + pd.to_timedelta((3 - quarter) * 91, unit="D")
+
+    df = pd.DataFrame({
+        "DisclosedDate" : disclosed.strftime("%Y-%m-%d"),
+        "DisclosedTime" : "15:00:00",
+        "LocalCode" : code,
+        "DisclosureNumber" : np.arange(len(code)).astype(str),
+        "TypeOfDocument" : np.where(quarter == 3, "FYFinancialStatements_Consolidated_JP", "3QFinancialStatements_Consolidated_JP"),
+        "TypeOfCurrentPeriod" : np.array(["1Q", "2Q", "3Q", "FY"])[quarter],
+        "CurrentPeriodStartDate" : (pd.to_datetime(end) - pd.to_timedelta(90, unit="D")).strftime("%Y-%m-%d"),
+        "CurrentPeriodEndDate" : pd.to_datetime(end).strftime("%Y-%m-%d"),
+        "CurrentFiscalYearStartDate" : (fiscal_end - pd.to_timedelta(364, unit="D")).strftime("%Y-%m-%d"),
+        "CurrentFiscalYearEndDate" : fiscal_end.strftime("%Y-%m-%d"),
+    })
+    df["DisclosedUnixTime"] = pd.to_datetime(df["DisclosedDate"] + " " + df["DisclosedTime"]).astype("int64") // 10**9
+
+    values = rng.lognormal(20, 2, (len(code), len(statement_numeric_columns)))
+    values[rng.random(values.shape) < 0.1] = np.nan
+    for i, col in enumerate(statement_numeric_columns):
+        df[col] = np.where(np.isnan(values[:, i]), "", np.round(values[:, i], 2).astype(str))
+
+    # 訂正開示の重複を一部混ぜる
+    revisions = df.sample(frac=0.05, random_state=seed).assign(TypeOfDocument="ForecastRevision")
+    return pd.concat([df, revisions], ignore_index=True)
+
+
+def make_listed_info(n_codes, seed=0, end=default_end):
+    rng = np.random.default_rng(seed + 2)
+    codes = make_codes(n_codes)
+    s33 = rng.integers(0, len(sector_33_names), n_codes)
+    s17 = rng.integers(0, len(sector_17_names), n_codes)
+    return pd.DataFrame({
+        "Date" : make_dates(1, end)[-1].strftime("%Y-%m-%d"),
+        "Code" : codes,
+        "CompanyName" : ["銘柄%s" % code[:4] for code in codes],
+        "Sector17Code" : s17.astype(str),
+        "Sector17CodeName" : np.array(sector_17_names)[s17],
+        "Sector33Code" : s33.astype(str),
+        "Sector33CodeName" : np.array(sector_33_names)[s33],
+        "MarketCode" : "0111",
+        "MarketCodeName" : "プライム",
+    })
+
+
+def make_panel(n_codes, n_years, seed=0, end=default_end):
+    # 開発用パネル (stock_df_dev.pkl) と同じスキーマ
+    prices = make_prices(n_codes, n_years, seed, end)
+    info = make_listed_info(n_codes, seed, end).set_index("Code")
+    return pd.DataFrame({
+        "DATE" : prices["Date"].dt.strftime("%Y-%m-%d"),
+        "CODE" : prices["Code"].str[:4],
+        "COMPANYNAME" : info["CompanyName"].reindex(prices["Code"]).values,
+        "SECTOR33CODENAME" : info["Sector33CodeName"].reindex(prices["Code"]).values,
+        "SECTOR17CODENAME" : info["Sector17CodeName"].reindex(prices["Code"]).values,
+        "CLOSE" : prices["AdjustmentClose"],
+        "VOLUME" : prices["AdjustmentVolume"],
+    })
+
+
+class SyntheticClient(object):
+    # jquantsapi.Clientの代わりに合成データを返すクライアント (ベンチマーク用)
+    def __init__(self, n_codes=100, n_years=3, seed=0, end=default_end):
+        self.prices = make_prices(n_codes, n_years, seed, end)
+        self.statements = make_statements(n_codes, n_years, seed, end)
+        self.listed_info = make_listed_info(n_codes, seed, end)
+
+    def get_price_range(self, start_dt, end_dt):
+        dates = self.prices["Date"]
+        start_dt = pd.Timestamp(start_dt).tz_localize(None).normalize()
+        end_dt = pd.Timestamp(end_dt).tz_localize(None)
+        return self.prices[(dates >= start_dt) & (dates <= end_dt)].reset_index(drop=True)
+
+    def get_statements_range(self, start_dt, end_dt):
+        dates = pd.to_datetime(self.statements["DisclosedDate"])
+        start_dt = pd.Timestamp(start_dt).tz_localize(None).normalize()
+        end_dt = pd.Timestamp(end_dt).tz_localize(None)
+        return self.statements[(dates >= start_dt) & (dates <= end_dt)].reset_index(drop=True)
+
+    def get_listed_info(self):
+        return self.listed_info.copy()
@@ -0,0 +1,209 @@
+import glob
+import os
+import re
+import shutil
+import threading
+from datetime import datetime, timezone
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+from script.schema import schemas, snowflake_schema
+
+
+warehouse_path = "./metadata/warehouse.duckdb"
+stage_dir = "./metadata/stage"
+
+# Snowflakeの型名からDuckDBの型名への対応
+duckdb_types = {"NUMBER" : "DOUBLE", "TIMESTAMP_TZ" : "TIMESTAMPTZ"}
+
+# Snowflake上のTaskに相当する処理 (更新テーブルを本テーブルへキー単位でマージ)
+local_tasks = {
+    "stock_update_task" : ("stock_update", "stock", ["Code", "Date"]),
+    "financial_update_task" : ("financial_update", "financial", ["LocalCode", "DisclosedDate"]),
+    "topix_update_task" : ("topix_update", "topix", ["Date"]),
+}
+
+# 型定義の列の型 (CSVから読み込む際に変換し、定義の無い列は文字列のまま)
+column_kinds = {col: kind for schema in schemas.values() for col, kind in schema["columns"].items()}
+
+
+class LocalWarehouse(object):
+    # Snowflakeクラスと同じメソッドを持つ、DuckDBによるローカルの分析用データベース
+    # ステージはローカルのディレクトリ、TaskはSQLのマージ処理として扱う
+    def __init__(self, path=warehouse_path, stage_root=stage_dir):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.stage_root = stage_root
+        self.connection = duckdb.connect(path)
+        self.lock = threading.RLock()
+        self.active_tasks = set()
+        self.execute('create table if not exists _load_history (table_name varchar, file varchar, size bigint, mtime double)')
+
+    def execute(self, query, params=None):
+        with self.lock:
+            return self.connection.execute(query, params or [])
+
+    def query(self, query, params=None):
+        with self.lock:
+            return self.connection.execute(query, params or []).df()
+
+    def stage_path(self, stage):
+        return os.path.join(self.stage_root, stage.lstrip("@"))
+
+    def staged_files(self, stage, pattern):
+        root = self.stage_path(stage)
+        files = sorted(path for path in glob.glob(os.path.join(root, "**", "*"), recursive=True) if os.path.isfile(path))
+        return [path for path in files if re.fullmatch(pattern, os.path.relpath(path, root))]
+
+    def exists_table(self, table):
+        return len(self.query("select 1 from information_schema.tables where lower(table_name) = lower(?)", [table])) > 0
+
+    def resume_task(self, task):
+        self.active_tasks.add(task)
+
+    def suspend_task(self, task):
+        self.active_tasks.discard(task)
+
+    def resume_tasks(self, tasks, wait=True):
+        for task in tasks:
+            self.resume_task(task)
+
+    def suspend_tasks(self, tasks, wait=True):
+        for task in tasks:
+            self.suspend_task(task)
+
+    def wait_pending(self):
+        # ローカルでは全て同期的に実行済み
+        return []
+
+    def current_timestamp(self):
+        return datetime.now(timezone.utc)
+
+    def run_task(self, task):
+        # 更新テーブルの内容をキー単位で本テーブルにマージし、更新テーブルを空にする (同一キーは後から入った行を採用)
+        # 更新テーブルが空の場合はSnowflakeのWHEN条件不成立と同じく実行しない (Falseを返す)
+        source, target, key = local_tasks[task]
+        if not self.exists_table(source) or not self.query("select count(*) as n from %s" % source)["n"].iloc[0]:
+            return False
+        keys = ", ".join(key)
+        with self.lock:
+            self.execute("begin transaction")
+            self.execute("create table if not exists %s as select * from %s limit 0" % (target, source))
+            self.execute("create temp table _latest as select * exclude (_rn) from (select *, row_number() over (partition by %s order by rowid desc) as _rn from %s) where _rn = 1" % (keys, source))
+            self.execute("delete from %s using _latest where %s" % (target, " and ".join("%s.%s = _latest.%s" % (target, col, col) for col in key)))
+            self.execute("insert into %s by name select * from _latest" % target)
+            self.execute("drop table _latest")
+            self.execute("delete from %s" % source)
+            self.execute("commit")
+        return True
+
+    def wait_tasks(self, since, timeout=900, interval=5, max_interval=60):
+        # ローカルでは待たずにその場でマージを実行して停止
+        states = {}
+        for task in since:
+            merged = self.run_task(task)
+            self.suspend_task(task)
+            states[task.lower()] = "SUCCEEDED" if merged else "SKIPPED"
+        return states
+
+    def put_stage(self, path, stage):
+        os.makedirs(self.stage_path(stage), exist_ok=True)
+        for file in glob.glob(path):
+            shutil.copy(file, self.stage_path(stage))
+
+    def stage_frame(self, df, stage, name, format='csv', files=1, encoding='utf8'):
+        # Snowflake.stage_frameと同じファイル名・形式でステージのディレクトリに書き出す
+        os.makedirs(self.stage_path(stage), exist_ok=True)
+        bounds = np.linspace(0, len(df), max(1, min(files, len(df))) + 1).astype(int)
+        size = 0
+        for i, (lo, hi) in enumerate(zip(bounds[:-1], bounds[1:])):
+            if format == 'parquet':
+                path = os.path.join(self.stage_path(stage), '%s.%d.parquet' % (name, i))
+                df.iloc[lo:hi].to_parquet(path, index=False, compression='snappy')
+            else:
+                path = os.path.join(self.stage_path(stage), '%s.%d.gz' % (name, i))
+                df.iloc[lo:hi].to_csv(path, index=False, encoding=encoding, compression='gzip')
+            size += os.path.getsize(path)
+        return size
+
+    def read_staged(self, path):
+        if path.endswith('.parquet'):
+            return pd.read_parquet(path)
+        # 取り込み時の文字コード (utf8 / cp932) を判定して読み込む
+        for encoding in ['utf8', 'cp932']:
+            try:
+                df = pd.read_csv(path, encoding=encoding, dtype=str, keep_default_na=False, na_values=[''])
+                break
+            except UnicodeDecodeError:
+                continue
+        for col in df.columns:
+            kind = column_kinds.get(col)
+            if kind == 'date':
+                df[col] = pd.to_datetime(df[col])
+            elif kind in ('float64', 'int64'):
+                df[col] = pd.to_numeric(df[col], errors='coerce')
+        return df
+
+    def load_files(self, table, files, force=False):
+        # 取り込み済みのファイル (名前・サイズ・更新時刻が同じもの) は読み飛ばす (forceの場合は必ず取り込む)
+        for path in files:
+            stat = os.stat(path)
+            name = os.path.relpath(path, self.stage_root)
+            loaded = self.query('select 1 from _load_history where table_name = ? and file = ? and size = ? and mtime = ?',
+                                [table, name, stat.st_size, stat.st_mtime])
+            if len(loaded) and not force:
+                continue
+            df = self.read_staged(path)
+            with self.lock:
+                self.connection.register('_staged', df)
+                if self.exists_table(table):
+                    self.execute('insert into %s by name select * from _staged' % table)
+                else:
+                    self.execute('create table %s as select * from _staged' % table)
+                self.connection.unregister('_staged')
+                self.execute('insert into _load_history values (?, ?, ?, ?)', [table, name, stat.st_size, stat.st_mtime])
+
+    def copy_table(self, table, stage, format, pattern):
+        self.load_files(table, self.staged_files(stage, pattern))
+
+    def copy_table_parquet(self, table, stage, pattern):
+        self.load_files(table, self.staged_files(stage, pattern))
+
+    def apply_diff(self, table, key, keys, stage, format, pattern, copy=True):
+        # 変更・削除のあったキーの行を削除し、ステージ済みの変更行を取り込む (1トランザクション)
+        with self.lock:
+            self.execute('begin transaction')
+            self.connection.register('_keys', keys.astype(str))
+            self.execute('delete from %s using _keys where %s' % (
+                table, ' and '.join('cast(%s.%s as varchar) = _keys.%s' % (table, col, col) for col in key)))
+            self.connection.unregister('_keys')
+            if copy:
+                self.load_files(table, self.staged_files(stage, pattern), force=True)
+            self.execute('commit')
+
+    def remove_stage(self, stage, wait=True):
+        shutil.rmtree(self.stage_path(stage), ignore_errors=True)
+
+    def convert_column_type(self, df):
+        return snowflake_schema(df)
+
+    def replace_table(self, table, schema):
+        for name, local in duckdb_types.items():
+            schema = re.sub(r'\b%s\b' % name, local, schema)
+        self.execute('create or replace table %s (%s);' % (table, schema))
+
+    def truncate_table(self, table):
+        self.execute('delete from %s;' % table)
+
+    def close(self):
+        self.connection.close()
+
+
+def open_warehouse():
+    # 環境変数warehouse_backend=localの場合はローカルのDuckDB、それ以外はSnowflakeに接続
+    if os.environ.get("warehouse_backend") == "local":
+        return LocalWarehouse()
+    from script.connect import Snowflake
+    return Snowflake()
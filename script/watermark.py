@@ -0,0 +1,67 @@
+import os
+import pickle
+
+import pandas as pd
+
+
+watermark_dir = "./metadata/watermark"
+
+
+class Watermark(object):
+    # データセットごとの取り込み済み上限(ハイウォーターマーク)と、安全のための重複期間内の行ハッシュを保持
+    # 重複期間で再取得した行のうち、前回と内容が同じものはアップロード対象から除外する
+    # (columnはkeyに含まれる日付列)
+    def __init__(self, name, key, column, overlap_days=3, directory=watermark_dir):
+        self.name = name
+        self.key = list(key)
+        self.column = column
+        self.overlap = pd.Timedelta(overlap_days, unit="D")
+        self.path = os.path.join(directory, "%s.pkl" % name)
+        self.value = None
+        self.hashes = pd.DataFrame(columns=self.key + ["HASH"])
+
+    def start(self, tz="Asia/Tokyo"):
+        # 取得開始日時 (未取り込みの場合はNone)
+        if self.value is None:
+            return None
+        return (self.value - self.overlap).tz_localize(tz)
+
+    def row_hash(self, df):
+        return pd.util.hash_pandas_object(df, index=False).values
+
+    def filter(self, df):
+        # 取り込み済みと同一の行を除外し、新規または訂正された行のみ返す
+        if self.value is None or len(df) == 0 or len(self.hashes) == 0:
+            return df
+        rows = df[self.key].assign(HASH=self.row_hash(df))
+        seen = rows.merge(self.hashes, on=self.key + ["HASH"], how="left", indicator=True)["_merge"].values == "both"
+        return df[~seen]
+
+    def commit(self, df):
+        # アップロード完了後に上限と重複期間内の行ハッシュを更新
+        if len(df) == 0:
+            return
+        dates = pd.to_datetime(df[self.column])
+        self.value = max(dates.max(), self.value) if self.value is not None else dates.max()
+
+        rows = df[self.key].assign(HASH=self.row_hash(df))
+        hashes = pd.concat([self.hashes, rows], ignore_index=True) if len(self.hashes) else rows
+        hashes = hashes.drop_duplicates(subset=self.key, keep="last")
+        self.hashes = hashes[pd.to_datetime(hashes[self.column]) >= self.value - self.overlap].reset_index(drop=True)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as file:
+            pickle.dump({"value" : self.value, "hashes" : self.hashes}, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+
+    @classmethod
+    def load(cls, name, key, column, overlap_days=3, directory=watermark_dir):
+        watermark = cls(name, key, column, overlap_days, directory)
+        if os.path.exists(watermark.path):
+            with open(watermark.path, "rb") as file:
+                state = pickle.load(file)
+            watermark.value = state["value"]
+            watermark.hashes = state["hashes"]
+        return watermark